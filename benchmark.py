@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Headless benchmark of eaf-git workers on synthetic repositories.
+#
+# Usage:
+#   python3 benchmark.py --files 5000 --commits 2000 --dirty 500 --output result.json
+#   python3 benchmark.py --output new.json --compare result.json
+#
+# Workers run in current thread with stand-ins of EAF core, no Emacs or browser needed.
+# PyQt6 is replaced by stand-ins too if it is not installed, mime of files is then guessed by file name.
+# pygit2 and other python dependencies of eaf-git still need installed.
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+import pygit2
+from pygit2 import GIT_FILEMODE_BLOB, GIT_FILEMODE_COMMIT, IndexEntry, Signature
+
+SEARCH_KEYWORD = "eaf_git_benchmark_keyword"
+LOG_SEARCH_STRING = "commit 12"
+
+# Newest commits that are not in remote branch, so unpushed list is not empty.
+UNPUSHED_COMMITS = 10
+
+def install_core_stand_ins():
+    "Install stand-ins of EAF core modules if run out of EAF, eval_js_function and emacs calls do nothing."
+    try:
+        importlib.import_module("core.utils")
+        importlib.import_module("core.webengine")
+        return
+    except ImportError:
+        pass
+
+    core = types.ModuleType("core")
+    core_utils = types.ModuleType("core.utils")
+    core_webengine = types.ModuleType("core.webengine")
+
+    def decorator_stand_in(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and len(kwargs) == 0:
+            return args[0]
+        return lambda func: func
+
+    class BrowserBuffer:
+        def __init__(self, *args):
+            self.buffer_widget = types.SimpleNamespace(eval_js_function=lambda *args: None)
+
+    core_utils.PostGui = decorator_stand_in
+    core_utils.interactive = decorator_stand_in
+    core_utils.eval_in_emacs = lambda *args: None
+    core_utils.get_emacs_func_result = lambda *args: None
+    core_utils.get_emacs_var = lambda name: None
+    core_utils.get_emacs_vars = lambda names: [None] * len(names)
+    core_utils.message_to_emacs = lambda *args: None
+    core_webengine.BrowserBuffer = BrowserBuffer
+
+    core.utils = core_utils
+    core.webengine = core_webengine
+    sys.modules["core"] = core
+    sys.modules["core.utils"] = core_utils
+    sys.modules["core.webengine"] = core_webengine
+
+def install_qt_stand_ins():
+    "Install stand-ins of PyQt6 if it is not installed, workers only need signals, threads run in current thread."
+    try:
+        importlib.import_module("PyQt6.QtCore")
+        importlib.import_module("PyQt6.QtGui")
+        return
+    except ImportError:
+        pass
+
+    import mimetypes
+
+    class BoundSignal:
+        def __init__(self):
+            self.slots = []
+
+        def connect(self, slot):
+            self.slots.append(slot)
+
+        def emit(self, *args):
+            for slot in list(self.slots):
+                slot(*args)
+
+    class Signal:
+        def __init__(self, *types):
+            self.name = None
+
+        def __set_name__(self, owner, name):
+            self.name = name
+
+        def __get__(self, obj, owner=None):
+            if obj is None:
+                return self
+            return obj.__dict__.setdefault("_signal_" + self.name, BoundSignal())
+
+    class QObject:
+        def __init__(self, *args, **kwargs):
+            pass
+
+    class QThread(QObject):
+        finished = Signal()
+
+        def start(self):
+            self.run()
+            self.finished.emit()
+
+        def isRunning(self):
+            return False
+
+        def requestInterruption(self):
+            self.interruption_requested = True
+
+        def isInterruptionRequested(self):
+            return getattr(self, "interruption_requested", False)
+
+        def wait(self, *args):
+            return True
+
+    class QTimer(QObject):
+        timeout = Signal()
+
+        def setSingleShot(self, single_shot):
+            pass
+
+        def start(self, *args):
+            pass
+
+        def stop(self):
+            pass
+
+        def singleShot(self, interval, slot):
+            pass
+
+    class QMimeDatabase:
+        def mimeTypeForFile(self, path):
+            mime = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            return types.SimpleNamespace(name=lambda: mime)
+
+    class QColor:
+        def __init__(self, color):
+            self.color = color
+
+        def darker(self, factor):
+            return self
+
+        def name(self):
+            return self.color
+
+    qt = types.ModuleType("PyQt6")
+    qt_core = types.ModuleType("PyQt6.QtCore")
+    qt_gui = types.ModuleType("PyQt6.QtGui")
+
+    qt_core.pyqtSignal = Signal
+    qt_core.pyqtSlot = lambda *args, **kwargs: (lambda func: func)
+    qt_core.QObject = QObject
+    qt_core.QThread = QThread
+    qt_core.QTimer = QTimer
+    qt_core.QMimeDatabase = QMimeDatabase
+    qt_gui.QColor = QColor
+
+    qt.QtCore = qt_core
+    qt.QtGui = qt_gui
+    sys.modules["PyQt6"] = qt
+    sys.modules["PyQt6.QtCore"] = qt_core
+    sys.modules["PyQt6.QtGui"] = qt_gui
+
+def get_file_content(file_index, version, lines):
+    content = []
+    for line in range(lines):
+        if line % 97 == 0 and version % 5 == 0:
+            content.append("# {} {} {}\n".format(SEARCH_KEYWORD, file_index, version))
+        else:
+            content.append("line {} of file {} version {}\n".format(line, file_index, version))
+
+    return "".join(content)
+
+def get_file_path(file_index):
+    return "src/dir{}/file{}.py".format(file_index % 50, file_index)
+
+def create_submodule_repo(path, index):
+    sub_repo = pygit2.init_repository(path)
+    with open(os.path.join(path, "README.txt"), "w") as f:
+        f.write("submodule {}\n".format(index))
+    sub_repo.index.add("README.txt")
+    sub_repo.index.write()
+
+    signature = Signature("Benchmark", "benchmark@example.com")
+    return sub_repo.create_commit("HEAD", signature, signature, "init", sub_repo.index.write_tree(), [])
+
+def build_repository(path, args):
+    "Build synthetic repository with committed history, dirty worktree, untracked files and submodules."
+    repo = pygit2.init_repository(path)
+    index = repo.index
+    signature = Signature("Benchmark", "benchmark@example.com")
+    versions = [0] * args.files
+
+    for file_index in range(args.files):
+        blob_id = repo.create_blob(get_file_content(file_index, 0, args.file_lines))
+        index.add(IndexEntry(get_file_path(file_index), blob_id, GIT_FILEMODE_BLOB))
+
+    gitmodules = []
+    for sub_index in range(args.submodules):
+        sub_path = "modules/sub{}".format(sub_index)
+        commit_id = create_submodule_repo(os.path.join(path, sub_path), sub_index)
+        index.add(IndexEntry(sub_path, commit_id, GIT_FILEMODE_COMMIT))
+        gitmodules.append('[submodule "{0}"]\n\tpath = {0}\n\turl = ./{0}\n'.format(sub_path))
+    if len(gitmodules) > 0:
+        index.add(IndexEntry(".gitmodules", repo.create_blob("".join(gitmodules)), GIT_FILEMODE_BLOB))
+
+    parents = []
+    commit_ids = []
+    for commit_index in range(max(args.commits, 1)):
+        if commit_index > 0:
+            # Each commit change few files, so grep have both hit and miss commits.
+            for offset in range(args.files_per_commit):
+                file_index = (commit_index * args.files_per_commit + offset) % args.files
+                versions[file_index] += 1
+                blob_id = repo.create_blob(get_file_content(file_index, versions[file_index], args.file_lines))
+                index.add(IndexEntry(get_file_path(file_index), blob_id, GIT_FILEMODE_BLOB))
+
+        message = "Commit {}\n\nChange {} files.".format(commit_index, args.files_per_commit)
+        commit_id = repo.create_commit("HEAD", signature, signature, message, index.write_tree(), parents)
+        parents = [commit_id]
+        commit_ids.append(commit_id)
+
+    # Remote branch without upstream config, unpushed commits are fetched from default remote branch of same name.
+    if len(commit_ids) > UNPUSHED_COMMITS:
+        repo.references.create("refs/remotes/origin/{}".format(repo.head.shorthand), commit_ids[-UNPUSHED_COMMITS - 1])
+
+    index.write()
+    repo.checkout_head(strategy=pygit2.GIT_CHECKOUT_FORCE)
+
+    # Dirty files: first half staged, all of them modified in worktree again.
+    for file_index in range(min(args.dirty, args.files)):
+        file_path = os.path.join(path, get_file_path(file_index))
+        lines = get_file_content(file_index, versions[file_index], args.file_lines).splitlines(True)
+        for line in range(0, min(args.diff_lines, len(lines))):
+            lines[line] = "changed {}\n".format(lines[line])
+        with open(file_path, "w") as f:
+            f.writelines(lines)
+
+        if file_index < args.dirty // 2:
+            index.add(get_file_path(file_index))
+            with open(file_path, "a") as f:
+                f.write("unstaged line\n")
+    index.write()
+
+    for file_index in range(args.untracked):
+        file_path = os.path.join(path, "untracked/dir{}/new{}.txt".format(file_index % 20, file_index))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w") as f:
+            f.write("untracked line\n" * (file_index % 50 + 1))
+
+    return repo
+
+class BenchmarkTarget:
+    "Attributes of AppBuffer used by HighlightDiffThread."
+
+    def __init__(self, buffer, repo, repo_root, highlight_service):
+        self.repo = repo
+        self.repo_root = repo_root
+        self.untrack_status = buffer.StatusList()
+        self.file_metadata_cache = buffer.FileMetadataCache(buffer.QMimeDatabase())
+        self.highlight_style = "monokai"
+        self.diff_truncate_lines = 0
+        self.raw_patch_set = None
+        self.diff_cache = buffer.DiffCache()
+        self.highlight_service = highlight_service
+        self.diff_tick = 0
+
+def count_emitted(signal):
+    "Connect signal and return list that collect emitted arguments."
+    results = []
+    signal.connect(lambda *args: results.append(args))
+    return results
+
+def get_benchmarks(buffer, repo, repo_root, args):
+    branch = repo.branches.local[repo.head.shorthand]
+    dirty_paths = [get_file_path(file_index) for file_index in range(min(args.dirty, args.files))]
+
+    def status():
+        thread = buffer.FetchStatusThread(repo, repo_root, buffer.FileMetadataCache(buffer.QMimeDatabase()))
+        results = count_emitted(thread.fetch_result)
+        thread.run()
+        return sum(len(status_list) for status_list in results[0])
+
+    def status_paths():
+        thread = buffer.FetchStatusThread(repo, repo_root, buffer.FileMetadataCache(buffer.QMimeDatabase()), dirty_paths)
+        results = count_emitted(thread.patch_result)
+        thread.run()
+        return sum(len(status_list) for status_list in results[0][:3])
+
+    def log_first_page():
+        thread = buffer.FetchLogThread(repo, branch)
+        results = count_emitted(thread.fetch_result)
+        thread.run()
+        return len(results[0][2]["id"])
+
+    def log():
+        # Walk and index all commits, same as log view in background.
+        thread = buffer.FetchLogThread(repo, branch, True)
+        results = count_emitted(thread.finish_result)
+        thread.run()
+        return results[0][1]
+
+    log_cache = buffer.CommitLogCache()
+    log_cache.cache_dir = os.path.join(repo.path, "eaf-git", "benchmark-log")
+
+    def log_cached():
+        # First run fill cache, later runs only load cache.
+        thread = buffer.FetchLogThread(repo, branch, True, log_cache)
+        results = count_emitted(thread.finish_result)
+        thread.run()
+        return results[0][1]
+
+    log_thread = buffer.FetchLogThread(repo, branch, True)
+    log_pagers = count_emitted(log_thread.fetch_result)
+    log_thread.run()
+    log_search_index = log_pagers[0][1].search_index
+
+    def search_log():
+        # Search keyword char by char like typing in minibuffer, last search narrow previous matches.
+        log_search_index.last_search = None
+        return sum(len(log_search_index.search(LOG_SEARCH_STRING[:end])) for end in range(1, len(LOG_SEARCH_STRING) + 1))
+
+    def unpush():
+        thread = buffer.FetchUnpushThread(repo, None)
+        results = count_emitted(thread.fetch_result)
+        thread.run()
+        return len(results[0][1])
+
+    def grep():
+        thread = buffer.GrepLogThread(repo, branch, SEARCH_KEYWORD)
+        results = count_emitted(thread.finish_result)
+        thread.run()
+        return len(results[0][2])
+
+    # Highlight workers are warmed up when benchmark start, like buffer do after it created.
+    highlight_service = buffer.highlight_service
+
+    def diff(type, file="", target=None, first_batch=False):
+        def run():
+            diff_target = target or BenchmarkTarget(buffer, repo, repo_root, highlight_service)
+            thread = buffer.HighlightDiffThread(diff_target, type, file, 0)
+            results = count_emitted(thread.fetch_result)
+            append_results = count_emitted(thread.append_result)
+            if first_batch:
+                # Select other diff after first batch, time until page can show diff.
+                thread.fetch_result.connect(lambda *args: setattr(diff_target, "diff_tick", -1))
+            thread.run()
+
+            # Size of highlighted html send to page.
+            (_, _, _, diff_string, patch_set) = results[0]
+            patch_set = patch_set + [patch for result in append_results for patch in result[3]]
+            return len(diff_string) + sum(len(hunk) for patch in patch_set for hunk in patch["diff_hunks"])
+        return run
+
+    # Revisit same unchanged file, only first run render diff.
+    cached_diff_target = BenchmarkTarget(buffer, repo, repo_root, highlight_service)
+
+    return {
+        "status": status,
+        "status_paths": status_paths,
+        "log_first_page": log_first_page,
+        "log": log,
+        "log_cached": log_cached,
+        "search_log": search_log,
+        "unpush": unpush,
+        "grep": grep,
+        "diff_stage": diff("stage"),
+        "diff_unstage": diff("unstage"),
+        "diff_unstage_first": diff("unstage", first_batch=True),
+        "diff_file": diff("unstage", dirty_paths[0]),
+        "diff_file_cached": diff("unstage", dirty_paths[0], cached_diff_target)
+    }
+
+def run_benchmarks(args):
+    install_qt_stand_ins()
+    install_core_stand_ins()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import buffer
+
+    temp_dir = None
+    if args.repo_dir is not None and os.path.exists(os.path.join(args.repo_dir, ".git")):
+        repo_root = os.path.abspath(args.repo_dir)
+        repo = pygit2.Repository(repo_root)
+        build_time = 0
+    else:
+        if args.repo_dir is None:
+            temp_dir = tempfile.mkdtemp(prefix="eaf-git-benchmark-")
+            repo_root = temp_dir
+        else:
+            repo_root = os.path.abspath(args.repo_dir)
+            os.makedirs(repo_root, exist_ok=True)
+
+        start_time = time.perf_counter()
+        repo = build_repository(repo_root, args)
+        build_time = time.perf_counter() - start_time
+
+    buffer.highlight_service.acquire()
+    buffer.highlight_service.warm_up()
+    buffer.grep_log_service.acquire()
+    try:
+        benchmarks = get_benchmarks(buffer, repo, repo_root, args)
+        names = args.only.split(",") if args.only else list(benchmarks.keys())
+
+        results = {}
+        for name in names:
+            times = []
+            items = 0
+            for _ in range(args.repeat):
+                start_time = time.perf_counter()
+                items = benchmarks[name]()
+                times.append(time.perf_counter() - start_time)
+
+            results[name] = {
+                "min": min(times),
+                "median": statistics.median(times),
+                "times": times,
+                "items": items
+            }
+            print("{:<14} min {:9.4f}s  median {:9.4f}s  items {}".format(
+                name, results[name]["min"], results[name]["median"], items), file=sys.stderr)
+    finally:
+        buffer.highlight_service.release()
+        buffer.grep_log_service.release()
+
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {
+        "python": platform.python_version(),
+        "pygit2": pygit2.__version__,
+        "libgit2": pygit2.LIBGIT2_VERSION,
+        "sizes": {
+            "files": args.files,
+            "file_lines": args.file_lines,
+            "commits": args.commits,
+            "files_per_commit": args.files_per_commit,
+            "dirty": args.dirty,
+            "diff_lines": args.diff_lines,
+            "untracked": args.untracked,
+            "submodules": args.submodules
+        },
+        "build_time": build_time,
+        "results": results
+    }
+
+def compare_results(result, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    if baseline.get("sizes") != result["sizes"]:
+        print("Warning: sizes of baseline is different.", file=sys.stderr)
+
+    for (name, info) in result["results"].items():
+        if name in baseline["results"]:
+            base_time = baseline["results"][name]["min"]
+            ratio = info["min"] / base_time if base_time > 0 else 0
+            print("{:<14} {:9.4f}s -> {:9.4f}s  x{:.2f}".format(name, base_time, info["min"], ratio), file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark eaf-git workers on synthetic repository.")
+    parser.add_argument("--files", type=int, default=2000, help="number of tracked files")
+    parser.add_argument("--file-lines", type=int, default=200, help="lines of each tracked file")
+    parser.add_argument("--commits", type=int, default=500, help="number of commits")
+    parser.add_argument("--files-per-commit", type=int, default=3, help="changed files of each commit")
+    parser.add_argument("--dirty", type=int, default=200, help="number of dirty files, half of them are staged")
+    parser.add_argument("--diff-lines", type=int, default=20, help="changed lines of each dirty file")
+    parser.add_argument("--untracked", type=int, default=200, help="number of untracked files")
+    parser.add_argument("--submodules", type=int, default=0, help="number of submodules")
+    parser.add_argument("--repeat", type=int, default=3, help="run times of each benchmark")
+    parser.add_argument("--only", help="comma separated benchmark names: status,status_paths,log_first_page,log,log_cached,search_log,unpush,grep,diff_stage,diff_unstage,diff_file_cached")
+    parser.add_argument("--repo-dir", help="build repository in this directory, reuse it if it's already a repository")
+    parser.add_argument("--output", help="write JSON result to this file, default print to stdout")
+    parser.add_argument("--compare", help="JSON result of previous run to compare with")
+    args = parser.parse_args()
+
+    result = run_benchmarks(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+    if args.compare:
+        compare_results(result, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -19,10 +19,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import datetime
 import os
 import shutil
 from copy import copy
+from functools import lru_cache
 from io import StringIO
 
 import pygit2
@@ -39,7 +39,7 @@ from unidiff import LINE_TYPE_ADDED, LINE_TYPE_CONTEXT, LINE_TYPE_REMOVED, Hunk,
 import sys
 sys.path.append(os.path.dirname(__file__))
 
-from utils import get_git_https_url
+from utils import get_git_https_url, get_highlight_formatter, grep_log_commits, highlight_diff_fragments
 
 GIT_STATUS_DICT = {
     GIT_STATUS_CURRENT: "Current",
@@ -66,57 +66,75 @@ GIT_STATUS_INDEX_CHANGES = [
     GIT_STATUS_INDEX_TYPECHANGE,
 ]
 
+def build_status_flag_table():
+    "Map combined status flags to status keys, avoid decompose flags for every file."
+    flag_table = {}
+    for first_key in GIT_STATUS_DICT:
+        for second_key in GIT_STATUS_DICT:
+            flags = first_key | second_key
+            if flags in GIT_STATUS_DICT:
+                flag_table.setdefault(flags, (flags, ))
+            else:
+                flag_table.setdefault(flags, (first_key, second_key))
+
+    return flag_table
+
+GIT_STATUS_FLAG_TABLE = build_status_flag_table()
+
+# Status flags of "git status --porcelain" XY code, used by fast status mode.
+GIT_PORCELAIN_INDEX_STATUS = {
+    "M": GIT_STATUS_INDEX_MODIFIED,
+    "A": GIT_STATUS_INDEX_NEW,
+    "C": GIT_STATUS_INDEX_NEW,
+    "D": GIT_STATUS_INDEX_DELETED,
+    "T": GIT_STATUS_INDEX_TYPECHANGE
+}
+
+GIT_PORCELAIN_WORKTREE_STATUS = {
+    "M": GIT_STATUS_WT_MODIFIED,
+    "A": GIT_STATUS_WT_NEW,
+    "D": GIT_STATUS_WT_DELETED,
+    "T": GIT_STATUS_WT_TYPECHANGE
+}
+
+GIT_PORCELAIN_CONFLICTED = ["DD", "AU", "UD", "UA", "DU", "AA", "UU"]
+
 NO_PREVIEW = "Previewing binary data is not supported now. \n"
 
-def pretty_date(time):
-    """
-    Get a datetime object or a int() Epoch timestamp and return a
-    pretty string like 'an hour ago', 'Yesterday', '3 months ago',
-    'just now', etc
-    """
-    from datetime import datetime
-    now = datetime.now()
-    diff = 0
-
-    if isinstance(time, int):
-        diff = now - datetime.fromtimestamp(time)
-    elif isinstance(time, datetime):
-        diff = now - time
-    else:
-        return ""
-
-    second_diff = diff.seconds
-    day_diff = diff.days
-
-    if day_diff < 0:
-        return ''
-
-    if day_diff == 0:
-        if second_diff < 10:
-            return "just now"
-        if second_diff < 60:
-            return str(second_diff) + " seconds ago"
-        if second_diff < 120:
-            return "a minute ago"
-        if second_diff < 3600:
-            return str(second_diff // 60) + " minutes ago"
-        if second_diff < 7200:
-            return "an hour ago"
-        if second_diff < 86400:
-            return str(second_diff // 3600) + " hours ago"
-    if day_diff == 1:
-        return "Yesterday"
-    if day_diff < 7:
-        return str(day_diff) + " days ago"
-    if day_diff < 31:
-        return str(day_diff // 7) + " weeks ago"
-    if day_diff < 365:
-        return str(day_diff // 30) + " months ago"
-    return str(day_diff // 365) + " years ago"
-
-def bytes_decode(str_encode_bytes):
+# Number of commits in one page of log view.
+LOG_PAGE_SIZE = 200
+
+# Line count of file bigger than this size is extrapolated from newlines in head of this size,
+# so counting time of huge generated file is bounded.
+LINE_COUNT_SIZE_LIMIT = 8 * 1024 * 1024
+LINE_COUNT_CHUNK_SIZE = 1024 * 1024
+
+# Only memoize charset detection of short text, such as commit author and message.
+BYTES_DECODE_MEMO_MAX_LENGTH = 4096
+
+def bytes_decode(str_encode_bytes, encoding=None):
+    "Decode by encoding hint (such as encoding header of commit) or UTF-8, only detect charset if both failed."
+    if encoding:
+        try:
+            return str_encode_bytes.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            pass
+
+    try:
+        return str_encode_bytes.decode("utf-8")
+    except UnicodeDecodeError:
+        if len(str_encode_bytes) <= BYTES_DECODE_MEMO_MAX_LENGTH:
+            return memo_detect_bytes_decode(str_encode_bytes)
+        else:
+            return detect_bytes_decode(str_encode_bytes)
+
+def detect_bytes_decode(str_encode_bytes):
     return str(from_bytes(str_encode_bytes).best())
 
+@lru_cache(maxsize=1024)
+def memo_detect_bytes_decode(str_encode_bytes):
+    return detect_bytes_decode(str_encode_bytes)
+
 def is_binary(filename_or_bytes):
     """
     Return true if the given file or content appears to be binary.
@@ -135,6 +153,139 @@ def is_binary(filename_or_bytes):
                 return True
             return False
 
+def count_file_lines(file_path):
+    """
+    Count newline bytes by reading file chunk by chunk, files are counted one by one in status worker,
+    counting in thread pool don't run in parallel since bytes count hold GIL.
+    Return (line_count, approximate), line count of file bigger than LINE_COUNT_SIZE_LIMIT is estimated from its head.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            scan_size = min(size, LINE_COUNT_SIZE_LIMIT)
+
+            line_count = 0
+            scanned = 0
+            chunk = b""
+            while scanned < scan_size:
+                chunk = f.read(min(LINE_COUNT_CHUNK_SIZE, scan_size - scanned))
+                if len(chunk) == 0:
+                    break
+
+                line_count += chunk.count(b"\n")
+                scanned += len(chunk)
+
+            if size > scanned and scanned > 0:
+                return (int(line_count * size / scanned), True)
+            elif len(chunk) > 0 and not chunk.endswith(b"\n"):
+                # Last line without newline.
+                line_count += 1
+
+            return (line_count, False)
+    except OSError:
+        return (0, False)
+
+def match_pathspecs(path, pathspecs):
+    "Check if path is under one of pathspecs, or match pathspec glob, empty pathspecs match every path."
+    import fnmatch
+
+    if len(pathspecs) == 0:
+        return True
+
+    path = path.rstrip("/")
+    for pathspec in pathspecs:
+        pathspec = pathspec.rstrip("/")
+        if path == pathspec or path.startswith(pathspec + "/") or fnmatch.fnmatchcase(path, pathspec):
+            return True
+
+    return False
+
+def get_porcelain_status(repo_root, untracked_files, ignore_submodules, untracked_cache, pathspecs):
+    """
+    Get status by git command, libgit2 can't skip submodules or use untracked cache of index.
+    Return same format as Repository.status, or None if git command failed.
+    """
+    import subprocess
+
+    command = ["git", "-C", repo_root]
+    if untracked_cache:
+        command += ["-c", "core.untrackedCache=true"]
+    command += ["status", "--porcelain=v1", "-z", "--no-renames", "--untracked-files={}".format(untracked_files)]
+    if ignore_submodules:
+        command.append("--ignore-submodules=all")
+    command += ["--"] + list(pathspecs)
+
+    try:
+        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    status = {}
+    for entry in output.split(b"\0"):
+        if len(entry) < 4:
+            continue
+
+        code = entry[:2].decode()
+        file = os.fsdecode(entry[3:])
+
+        if code == "??":
+            status[file] = GIT_STATUS_WT_NEW
+        elif code in GIT_PORCELAIN_CONFLICTED:
+            status[file] = GIT_STATUS_CONFLICTED
+        else:
+            status[file] = GIT_PORCELAIN_INDEX_STATUS.get(code[0], 0) | GIT_PORCELAIN_WORKTREE_STATUS.get(code[1], 0)
+
+    return status
+
+def get_push_remote_name(repo, branch_name=None):
+    """
+    Get name of remote that branch is pushed to, lookup branch.<name>.pushRemote, remote.pushDefault, then fallback to origin.
+    Current branch is used if branch_name is None.
+    """
+    if branch_name is None and not repo.head_is_unborn and not repo.head_is_detached:
+        branch_name = repo.head.shorthand
+
+    config_names = ["remote.pushDefault"]
+    if branch_name is not None:
+        config_names.insert(0, "branch.{}.pushRemote".format(branch_name))
+
+    for config_name in config_names:
+        remote_name = next(repo.config.get_multivar(config_name), None)
+        if remote_name:
+            return remote_name
+
+    return "origin"
+
+def get_commit_record(commit):
+    """
+    Get (id, commit_time, commit_time_offset, author, message) of commit, message is the first line of commit message.
+    Commit time is epoch seconds, offset is minutes of committer timezone, relative time is formatted by JavaScript.
+    """
+    message_list = bytes_decode(commit.raw_message, commit.message_encoding).splitlines()
+
+    # Author never contain tab or newline and message is the last field, so records can be saved as tab separated lines.
+    return (str(commit.id),
+            int(commit.commit_time),
+            int(commit.commit_time_offset),
+            " ".join(bytes_decode(commit.author.raw_name, commit.message_encoding).split()),
+            message_list[0] if len(message_list) > 0 else "")
+
+def get_log_batch(offset, records, author_indexes, author_offset, authors):
+    """
+    Convert log records to columnar batch, UI fields of log item are filled by JavaScript.
+    Author is index of author table, authors are new entries of author table start from author_offset.
+    """
+    return {
+        "offset": offset,
+        "id": [record[0] for record in records],
+        "time": [record[1] for record in records],
+        "timeOffset": [record[2] for record in records],
+        "author": [author_indexes[record[3]] for record in records],
+        "message": [record[4] for record in records],
+        "authorOffset": author_offset,
+        "authors": authors
+    }
+
 def get_command_result(command_string, input_text=None):
     import subprocess
     process = subprocess.Popen(command_string, shell=True, text=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -186,51 +337,306 @@ def patch_stream(instream, hunks):
     for line in instream:
         yield line
 
-def parse_patch(patches, highlight):
-    patch_set = []
-    for patch in patches:
-        patch_set.append({
-            "path": patch.path,
-            "patch_info": "".join(patch.patch_info),
-            "diff_hunks": [highlight(str(hunk)) for hunk in patch]
-        })
-    return patch_set
-
-def status_is_include(status, file_info):
-    "Check if status1 has file_info"
-    for stat in status:
-        if stat["file"] == file_info["file"]:
-            return True
+def get_patch_hunks(patches):
+    """
+    Flatten patch set to (patch_index, path, patch_info, hunk, line_count) list, so huge diff can be sent by batches.
+    Patch without hunk, such as binary patch, has one None hunk to keep its header.
+    """
+    hunks = []
+    for (patch_index, patch) in enumerate(patches):
+        patch_info = "".join(patch.patch_info)
+        if len(patch) == 0:
+            hunks.append((patch_index, patch.path, patch_info, None, 0))
+        else:
+            for hunk in patch:
+                hunk_text = str(hunk)
+                hunks.append((patch_index, patch.path, patch_info, hunk_text, hunk_text.count("\n")))
+    return hunks
 
-    return False
+def get_file_patch_blobs(repo, type, file):
+    """
+    Return old and new side of file in staged or unstaged changes, so file is diffed without diffing whole repository.
+    Return None if blob diff may differ from repository diff, such as mode change, submodule, symlink or worktree filters.
+    """
+    import stat
+
+    blob_modes = (pygit2.GIT_FILEMODE_BLOB, pygit2.GIT_FILEMODE_BLOB_EXECUTABLE)
+    index = repo.index
+    if index.conflicts is not None:
+        return None
+
+    try:
+        index_entry = index[file]
+    except KeyError:
+        index_entry = None
+    if index_entry is not None and index_entry.mode not in blob_modes:
+        return None
+
+    if type == "stage":
+        head_tree = repo.revparse_single("HEAD^{tree}")
+        try:
+            head_blob = head_tree[file]
+        except KeyError:
+            head_blob = None
+
+        if head_blob is None and index_entry is None:
+            return None
+        if head_blob is not None and head_blob.filemode not in blob_modes:
+            return None
+        if head_blob is not None and index_entry is not None and (head_blob.filemode != index_entry.mode or head_blob.id == index_entry.id):
+            return None
+
+        return (head_blob, repo[index_entry.id] if index_entry is not None else None)
+    else:
+        if index_entry is None:
+            return None
+
+        # Worktree content is compared after clean filter, don't diff raw content if any filter may apply.
+        if "core.autocrlf" in repo.config and repo.config["core.autocrlf"].lower() != "false":
+            return None
+        for attr in ["filter", "text", "eol", "crlf", "ident", "working-tree-encoding"]:
+            if repo.get_attr(file, attr) is not None:
+                return None
+
+        path = os.path.join(repo.workdir, file)
+        try:
+            file_stat = os.lstat(path)
+        except FileNotFoundError:
+            return (repo[index_entry.id], None)
+
+        if not stat.S_ISREG(file_stat.st_mode) or bool(file_stat.st_mode & stat.S_IXUSR) != (index_entry.mode == pygit2.GIT_FILEMODE_BLOB_EXECUTABLE):
+            return None
+
+        with open(path, "rb") as f:
+            data = f.read()
+        if pygit2.hash(data) == index_entry.id:
+            return None
+
+        return (repo[index_entry.id], data)
+
+def get_file_patch_data(repo, type, file, blobs=None):
+    """
+    Return patch bytes of file in staged or unstaged changes, diff whole repository only if blob diff can't be used.
+    Blobs returned by get_file_patch_blobs can be passed, so file is diffed with same content that caller has seen.
+    """
+    if blobs is None:
+        try:
+            blobs = get_file_patch_blobs(repo, type, file)
+        except OSError:
+            blobs = None
+
+    if blobs is not None:
+        (old_blob, new_blob) = blobs
+        # Patch don't hold its blobs, read data before blobs are released.
+        return [pygit2.Patch.create_from(old_blob, new_blob, old_as_path=file, new_as_path=file).data]
+
+    if type == "stage":
+        diff = repo.index.diff_to_tree(repo.revparse_single("HEAD^{tree}"))
+    else:
+        diff = repo.diff(cached=True)
+    return [patch.data for patch in diff if patch.delta.new_file.path == file]
+
+def get_diff_line_stats(diff):
+    "Build path -> (add_count, delete_count) index from diff."
+    line_stats = {}
+    for patch in diff:
+        (_, add_count, delete_count) = patch.line_stats
+        line_stats.setdefault(patch.delta.new_file.path, (add_count, delete_count))
+
+    return line_stats
+
+def get_blob_line_stats(old_blob, new_data):
+    "Get (add_count, delete_count) between old blob and new blob or bytes."
+    if old_blob is None:
+        if new_data is None:
+            return (0, 0)
+        elif isinstance(new_data, bytes):
+            return (0, 0) if is_binary(new_data) else (len(new_data.splitlines()), 0)
+        else:
+            # Diff new blob to nothing, then swap deletions as additions.
+            (_, add_count, delete_count) = new_data.diff(None).line_stats
+            return (delete_count, add_count)
+    elif isinstance(new_data, bytes) or new_data is None:
+        (_, add_count, delete_count) = old_blob.diff_to_buffer(new_data).line_stats
+    else:
+        (_, add_count, delete_count) = old_blob.diff(new_data).line_stats
+
+    return (add_count, delete_count)
+
+def get_untrack_directory_files(repo, repo_root, directory, limit=None):
+    "Get untracked files under directory, stop walk when reach limit."
+    files = []
+    for (root, dirs, filenames) in os.walk(os.path.join(repo_root, directory)):
+        root_path = os.path.relpath(root, repo_root).replace(os.path.sep, "/")
+
+        # Skip nested repository and ignored directory.
+        dirs[:] = sorted([dir for dir in dirs
+                          if not os.path.exists(os.path.join(root, dir, ".git"))
+                          and not repo.path_is_ignored("{}/{}/".format(root_path, dir))])
+
+        for filename in sorted(filenames):
+            path = "{}/{}".format(root_path, filename)
+            if not repo.path_is_ignored(path):
+                files.append(path)
+
+                if limit is not None and len(files) >= limit:
+                    return files
+
+    return files
+
+def get_status_delta(old_status, new_status):
+    """
+    Get removed files and added/changed entries (with new index) between two status lists, keyed by file path.
+    Return whole new list if the order of kept entries is changed.
+    """
+    old_status_dict = {info["file"]: info for info in old_status}
+    new_files = set(info["file"] for info in new_status)
+
+    old_kept_files = [info["file"] for info in old_status if info["file"] in new_files]
+    new_kept_files = [info["file"] for info in new_status if info["file"] in old_status_dict]
+    if old_kept_files != new_kept_files:
+        return {"reset": new_status}
+
+    return {
+        "removed": [file for file in old_status_dict if file not in new_files],
+        "upsert": [[index, info] for (index, info) in enumerate(new_status) if old_status_dict.get(info["file"]) != info]
+    }
+
+class StatusEntry:
+    "Status of one file or collapsed untracked directory."
+
+    __slots__ = ("file", "type", "mime", "add_count", "delete_count", "file_count", "approximate")
+
+    def __init__(self, file, type, mime, add_count, delete_count, file_count=None, approximate=False):
+        self.file = file
+        self.type = type
+        self.mime = mime
+        self.add_count = add_count
+        self.delete_count = delete_count
+        self.file_count = file_count
+
+        # Add count is estimated from head of big untracked file.
+        self.approximate = approximate
+
+    def is_directory(self):
+        return self.file_count is not None
+
+    def to_dict(self):
+        info = {
+            "file": self.file,
+            "type": self.type,
+            "mime": self.mime,
+            "add_count": self.add_count,
+            "delete_count": self.delete_count
+        }
+
+        if self.file_count is not None:
+            info["file_count"] = self.file_count
+        if self.approximate:
+            info["approximate"] = True
+
+        return info
+
+class StatusList:
+    "Ordered status entries of one category, indexed by file path."
+
+    __slots__ = ("entries", "positions")
+
+    def __init__(self, entries=[]):
+        self.entries = []
+        self.positions = {}
+
+        for entry in entries:
+            self.append(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def __contains__(self, file):
+        return file in self.positions
+
+    def index(self, file):
+        return self.positions[file]
+
+    def append(self, entry):
+        "Append entry, return False if file already in list."
+        if entry.file in self.positions:
+            return False
+
+        self.positions[entry.file] = len(self.entries)
+        self.entries.append(entry)
+
+        return True
+
+    def remove(self, file):
+        position = self.positions.pop(file)
+        del self.entries[position]
+
+        for entry in self.entries[position:]:
+            self.positions[entry.file] -= 1
 
 class AppBuffer(BrowserBuffer):
     def __init__(self, buffer_id, url, arguments):
         BrowserBuffer.__init__(self, buffer_id, url, arguments, False)
 
-        self.stage_status = []
-        self.unstage_status = []
-        self.untrack_status = []
+        self.stage_status = StatusList()
+        self.unstage_status = StatusList()
+        self.untrack_status = StatusList()
         self.branch_status = []
+
+        # Status lists that JS side has, used to send delta only.
+        self.sent_status = {"stage": [], "unstage": [], "untrack": []}
         self.raw_patch_set = []
 
         self.nav_current_item = "Dashboard"
 
+        self.diff_type = None
+        self.diff_file = None
+        self.diff_tick = None
+        self.diff_pending = None
+
         self.mime_db = QMimeDatabase()
+        self.file_metadata_cache = FileMetadataCache(self.mime_db)
+        self.diff_cache = DiffCache()
+        self.highlight_service = highlight_service
+        self.highlight_service.acquire()
+        QTimer().singleShot(HighlightService.WARM_UP_DELAY, self.highlight_service.warm_up)
+        grep_log_service.acquire()
+        self.commit_log_cache = CommitLogCache()
 
-        self.search_log_cache_path = ""
-        self.search_submodule_cache_path = ""
+        self.unpush_key = None
 
-        self.temp_files = []
+        self.log_pager = None
+        self.log_search_index = None
+        self.compare_log_pager = None
+        self.submodule_search_index = None
 
         self.thread_reference_list = []
 
+        self.refresh_scheduler = RefreshScheduler(self.thread_reference_list)
+        self.status_adjust_selection = False
+        self.status_dirty_paths = set()
+        self.status_request_generation = 0
+        self.status_applied_generation = 0
+
         self.log_compare_branch = ""
 
         self.url = os.path.expanduser(self.url)
         self.repo = Repository(self.url)
         self.repo_root = self.url
 
+        self.worktree_watcher = WorktreeWatcher(self.repo, self.repo_root)
+
+        self.collapse_untrack_directory = False
+        self.status_options = {"ignore_submodules": False, "untracked_cache": False, "pathspecs": []}
+        self.expand_untrack_directories = {}
+
         eval_in_emacs('eaf--change-default-directory', [self.buffer_id, self.url])
 
         self.repo_path = os.path.sep.join(list(filter(lambda x: x != '', self.repo_root.split(os.path.sep)))[-2:])
@@ -247,7 +653,7 @@ class AppBuffer(BrowserBuffer):
             self.last_commit_id = str(self.repo.head.target)
             self.last_commit = self.repo.revparse_single(str(self.repo.head.target))
             try:
-                self.last_commit_message = bytes_decode(self.last_commit.raw_message).splitlines()[0]
+                self.last_commit_message = bytes_decode(self.last_commit.raw_message, self.last_commit.message_encoding).splitlines()[0]
             except:
                 pass
 
@@ -257,6 +663,23 @@ class AppBuffer(BrowserBuffer):
 
     def init_app(self):
         self.init_vars()
+
+        (watch_worktree, self.collapse_untrack_directory, persist_file_metadata, persist_commit_log) = get_emacs_vars([
+            "eaf-git-watch-worktree",
+            "eaf-git-collapse-untracked-directory",
+            "eaf-git-persist-file-metadata-cache",
+            "eaf-git-persist-commit-log-cache"
+        ])
+
+        if watch_worktree:
+            self.worktree_watcher.start()
+
+        if persist_file_metadata:
+            self.file_metadata_cache.load(os.path.join(self.repo.path, "eaf-git", "file-metadata.json"))
+
+        if persist_commit_log:
+            self.commit_log_cache.cache_dir = os.path.join(self.repo.path, "eaf-git", "log")
+
         self.update_git_info()
 
     def update_git_info(self):
@@ -278,6 +701,20 @@ class AppBuffer(BrowserBuffer):
             "eaf-git-unpushed-initial-state"
         ])
 
+        (status_ignore_submodules, status_untracked_cache, status_pathspecs) = get_emacs_vars([
+            "eaf-git-status-ignore-submodules",
+            "eaf-git-status-untracked-cache",
+            "eaf-git-status-pathspecs"
+        ])
+        self.status_options = {
+            "ignore_submodules": bool(status_ignore_submodules),
+            "untracked_cache": bool(status_untracked_cache),
+            "pathspecs": list(status_pathspecs or [])
+        }
+
+        # Diff threads read it from buffer, don't call Emacs from worker thread.
+        self.diff_truncate_lines = get_emacs_var("eaf-git-diff-truncate-lines") or 0
+
         if self.theme_mode == "dark":
             if self.theme_background_color == "#000000":
                 select_color = "#333333"
@@ -320,9 +757,46 @@ class AppBuffer(BrowserBuffer):
             {"lastCommit": self.last_commit_message},
             self.get_keybinding_info())
 
+        self.buffer_widget.eval_js_function("updateStatusMode", self.get_status_mode())
+
+        # Diff is highlighted as HTML fragment, style sheet is only sent when theme changed.
+        self.buffer_widget.eval_js_function("updateHighlightStyle", get_highlight_formatter(self.highlight_style).get_style_defs("body"))
+
+    def get_status_mode(self):
+        "Description of fast status options that show in status title."
+        modes = []
+        if self.status_options["ignore_submodules"]:
+            modes.append("no submodules")
+        if self.status_options["untracked_cache"]:
+            modes.append("untracked cache")
+        if len(self.status_options["pathspecs"]) > 0:
+            modes.append("scope: {}".format(" ".join(self.status_options["pathspecs"])))
+
+        return ", ".join(modes)
+
     def some_view_show(self):
         # Automatically refresh the Git status when the interface is displayed.
-        self.update_git_info()
+        # Only re-query dirty paths if worktree watcher is running and index is not changed.
+        dirty_paths = self.worktree_watcher.take_dirty_paths()
+        if dirty_paths is None:
+            self.update_git_info()
+        else:
+            self.fetch_unpush_info()
+            self.fetch_log_info()
+            self.fetch_stash_info()
+            self.fetch_submodule_info()
+            self.fetch_branch_info()
+
+            if len(dirty_paths) > 0:
+                self.fetch_status_paths_info(dirty_paths)
+
+    def destroy_buffer(self):
+        self.worktree_watcher.stop()
+        self.file_metadata_cache.save()
+        self.highlight_service.release()
+        grep_log_service.release()
+
+        super().destroy_buffer()
 
     @interactive
     def update_theme(self):
@@ -330,21 +804,92 @@ class AppBuffer(BrowserBuffer):
         self.init_vars()
 
     def fetch_status_info(self, adjust_selection=False):
-        thread = FetchStatusThread(self.repo, self.repo_root, self.mime_db)
+        # Coalesce rapid refresh requests, adjust selection if any request need it.
+        self.status_adjust_selection = self.status_adjust_selection or adjust_selection
+        self.status_request_generation += 1
+        self.refresh_scheduler.schedule("status", self.create_fetch_status_thread)
+
+    def fetch_status_paths_info(self, paths):
+        self.status_dirty_paths |= set(paths)
+
+        # Don't cancel running full walk, paths are refreshed after it finished.
+        self.refresh_scheduler.schedule("status", self.create_fetch_status_thread, interrupt=False)
+
+    def create_fetch_status_thread(self):
+        # Full walk and path-limited walk share one panel, so at most one status walk is in flight.
+        # Full walk is started again until its result is applied, it covers paths requested meanwhile.
+        if self.status_request_generation > self.status_applied_generation:
+            return self.create_fetch_full_status_thread()
+        elif len(self.status_dirty_paths) > 0:
+            return self.create_fetch_status_paths_thread()
+        else:
+            return None
+
+    def create_fetch_full_status_thread(self):
+        # Full status walk will cover all dirty paths that watcher recorded before.
+        self.worktree_watcher.sync()
+        self.status_dirty_paths = set()
+
+        thread = FetchStatusThread(self.repo, self.repo_root, self.file_metadata_cache,
+                                   collapse_directory=self.collapse_untrack_directory,
+                                   expand_directories=list(self.expand_untrack_directories.keys()),
+                                   status_options=self.status_options)
+
+        generation = self.status_request_generation
+        thread.fetch_result.connect(lambda stage_status, unstage_status, untrack_status:
+                                    self.apply_full_status_info(generation, stage_status, unstage_status, untrack_status))
+
+        return thread
+
+    @PostGui()
+    def apply_full_status_info(self, generation, stage_status, unstage_status, untrack_status):
+        self.status_applied_generation = max(self.status_applied_generation, generation)
 
         # If adjust_selection is True, update both status_info and the selection of status.
-        if adjust_selection:
-            thread.fetch_result.connect(self.update_status_info_and_selection)
+        if self.status_adjust_selection:
+            self.status_adjust_selection = False
+            self.update_status_info_and_selection(stage_status, unstage_status, untrack_status)
         else:
-            thread.fetch_result.connect(self.update_status_info)
+            self.update_status_info(stage_status, unstage_status, untrack_status)
 
-        self.thread_reference_list.append(thread)
-        thread.start()
+    def create_fetch_status_paths_thread(self):
+        thread = FetchStatusThread(self.repo, self.repo_root, self.file_metadata_cache, list(self.status_dirty_paths),
+                                   collapse_directory=self.collapse_untrack_directory,
+                                   expand_directories=list(self.expand_untrack_directories.keys()),
+                                   status_options=self.status_options)
+        thread.patch_result.connect(self.patch_status_info)
+
+        self.status_dirty_paths = set()
+
+        return thread
+
+    @PostGui()
+    def patch_status_info(self, stage_status, unstage_status, untrack_status, paths):
+        paths = set(paths)
+
+        # Files under collapsed untracked directory are counted by directory item.
+        collapse_directories = tuple(info.file for info in self.untrack_status
+                                     if info.is_directory() and info.file not in paths)
+        if len(collapse_directories) > 0:
+            untrack_status = StatusList(info for info in untrack_status if not info.file.startswith(collapse_directories))
+
+        (stage_status, unstage_status, untrack_status) = [
+            StatusList(sorted([info for info in status_list if info.file not in paths] + list(path_status_list),
+                              key=lambda info: info.file))
+            for (status_list, path_status_list) in [(self.stage_status, stage_status),
+                                                    (self.unstage_status, unstage_status),
+                                                    (self.untrack_status, untrack_status)]]
+
+        self.update_status_info(stage_status, unstage_status, untrack_status)
 
     @PostGui()
     def update_status_info(self, stage_status, unstage_status, untrack_status, select=None):
+        self.stage_status = stage_status
+        self.unstage_status = unstage_status
+        self.untrack_status = untrack_status
+
         if select is None:
-            self.buffer_widget.eval_js_function("updateStatusInfo", stage_status, unstage_status, untrack_status)
+            self.send_status_info()
         else:
             select_item_index = -1
             select_item_type = ""
@@ -356,14 +901,35 @@ class AppBuffer(BrowserBuffer):
             elif len(stage_status) > 0:
                 select_item_type = "stage"
 
-            self.buffer_widget.eval_js_function("updateSelectInfo", stage_status, unstage_status, untrack_status, select_item_type, select_item_index)
+            self.send_status_info(select_item_type, select_item_index)
 
         QTimer().singleShot(300, self.init_diff)
 
+    def send_status_info(self, select_item_type=None, select_item_index=-1):
+        "Send only removed, added and changed status entries to JS side, keep selection if select_item_type is None."
+        status_delta = {}
+        for (type, status_list) in [("stage", self.stage_status),
+                                    ("unstage", self.unstage_status),
+                                    ("untrack", self.untrack_status)]:
+            status_dicts = [info.to_dict() for info in status_list]
+            status_delta[type] = get_status_delta(self.sent_status[type], status_dicts)
+            self.sent_status[type] = status_dicts
+
+        self.buffer_widget.eval_js_function("patchStatusInfo", status_delta, select_item_type, select_item_index)
+
     @PostGui()
     def update_status_info_and_selection(self, stage_status, unstage_status, untrack_status):
         self.update_status_info(stage_status, unstage_status, untrack_status, True)
 
+    @QtCore.pyqtSlot(int)
+    def status_toggle_untrack_directory(self, file_index):
+        file_info = self.untrack_status[file_index]
+
+        if file_info.is_directory():
+            # Enumerate files in untracked directory only when user expand it.
+            self.expand_untrack_directories[file_info.file] = file_info
+            self.fetch_status_paths_info([file_info.file])
+
     def init_diff(self):
         if len(self.untrack_status) > 0:
             self.update_diff("untrack", "")
@@ -391,43 +957,91 @@ class AppBuffer(BrowserBuffer):
         return js_keybindig_dict
 
     def fetch_unpush_info(self):
-        thread = FetchUnpushThread(self.repo, self.repo_root)
+        self.refresh_scheduler.schedule("unpush", self.create_fetch_unpush_thread)
+
+    def create_fetch_unpush_thread(self):
+        thread = FetchUnpushThread(self.repo, self.unpush_key)
         thread.fetch_result.connect(self.update_unpush_info)
-        self.thread_reference_list.append(thread)
-        thread.start()
+        return thread
 
     @PostGui()
-    def update_unpush_info(self, unpush_list):
-        self.buffer_widget.eval_js_function("updateUnpushInfo", unpush_list)
+    def update_unpush_info(self, unpush_key, unpush_list, ahead, behind):
+        self.unpush_key = unpush_key
+        self.buffer_widget.eval_js_function("updateUnpushInfo", unpush_list, ahead, behind)
 
     @QtCore.pyqtSlot()
     def fetch_log_info(self):
         if self.repo.head_is_unborn: return  # noqa: E701
-        thread = FetchLogThread(self.repo, self.repo.head, True)
+        self.refresh_scheduler.schedule("log", self.create_fetch_log_thread)
+
+    def create_fetch_log_thread(self):
+        if self.repo.head_is_unborn: return None  # noqa: E701
+        thread = FetchLogThread(self.repo, self.repo.head, True, self.commit_log_cache)
         thread.fetch_result.connect(self.update_log_info)
-        self.thread_reference_list.append(thread)
-        thread.start()
+        thread.finish_result.connect(self.update_log_total)
+        return thread
+
+    @PostGui()
+    def update_log_info(self, branch_name, log_pager, log_batch):
+        # Refreshed log replace grep result.
+        self.refresh_scheduler.cancel("grep_log")
+
+        self.log_pager = log_pager
+        self.log_search_index = log_pager.search_index
+        self.buffer_widget.eval_js_function("updateLogInfo", branch_name, log_batch)
+
+    @PostGui()
+    def update_log_total(self, branch_name, total):
+        self.buffer_widget.eval_js_function("updateLogTotal", branch_name, total)
+
+    @QtCore.pyqtSlot(str, int, int)
+    def fetch_log_page(self, branch_name, offset, limit):
+        log_pager = self.log_pager
+
+        # Streaming log will send new records itself.
+        if log_pager is not None and (offset < len(log_pager) or log_pager.records_iter is not None):
+            self.refresh_scheduler.schedule("log_page", lambda: self.create_fetch_log_page_thread(
+                log_pager, branch_name, offset, limit, self.send_log_page), interrupt=False)
+
+    @QtCore.pyqtSlot(str, int, int)
+    def fetch_compare_log_page(self, branch_name, offset, limit):
+        compare_log_pager = self.compare_log_pager
+
+        if compare_log_pager is not None:
+            self.refresh_scheduler.schedule("compare_log_page", lambda: self.create_fetch_log_page_thread(
+                compare_log_pager, branch_name, offset, limit, self.send_compare_log_page), interrupt=False)
+
+    def create_fetch_log_page_thread(self, log_pager, branch_name, offset, limit, callback):
+        # Walking commits and reading evicted pages may be slow, don't block GUI thread.
+        thread = FetchLogPageThread(log_pager, branch_name, offset, limit)
+        thread.fetch_result.connect(callback)
+        return thread
 
     @PostGui()
-    def update_log_info(self, branch_name, log, search_cache_path, append):
-        if self.search_log_cache_path != "" and os.path.exists(self.search_log_cache_path):
-            if self.search_log_cache_path not in self.temp_files:
-                self.temp_files.append(self.search_log_cache_path)
+    def send_log_page(self, branch_name, log_pager, log_batch):
+        if log_pager is self.log_pager:
+            self.buffer_widget.eval_js_function("appendLogPage", branch_name, log_batch)
 
-        self.search_log_cache_path = search_cache_path
-        self.buffer_widget.eval_js_function("updateLogInfo", branch_name, log, append)
+    @PostGui()
+    def send_compare_log_page(self, branch_name, log_pager, log_batch):
+        if log_pager is self.compare_log_pager:
+            self.buffer_widget.eval_js_function("appendCompareLogPage", branch_name, log_batch)
 
     def fetch_compare_log_info(self, branch_name):
         branch = self.repo.branches.get(branch_name)
 
-        thread = FetchLogThread(self.repo, branch)
-        thread.fetch_result.connect(self.update_compare_log_info)
-        self.thread_reference_list.append(thread)
-        thread.start()
+        def create_fetch_compare_log_thread():
+            if self.repo.head_is_unborn: return None  # noqa: E701
+            thread = CompareLogThread(self.repo, branch, self.repo.head, self.commit_log_cache)
+            thread.fetch_result.connect(self.update_compare_log_info)
+            return thread
+
+        self.refresh_scheduler.schedule("compare_log", create_fetch_compare_log_thread)
 
     @PostGui()
-    def update_compare_log_info(self, branch_name, log, search_cache_path, append):
-        self.buffer_widget.eval_js_function("updateCompareLogInfo", branch_name, log, append)
+    def update_compare_log_info(self, branch_name, log_pager, log_batch, compare_info):
+        self.compare_log_pager = log_pager
+        self.buffer_widget.eval_js_function("updateCompareLogInfo", branch_name, log_batch, compare_info)
 
     @QtCore.pyqtSlot()
     def grep_log_info(self):
@@ -438,52 +1052,68 @@ class AppBuffer(BrowserBuffer):
 
         message_to_emacs(f"Grep log with keyword: {keyword}...")
 
-        thread = GrepLogThread(self.repo, self.repo.head, keyword, True)
-        thread.fetch_result.connect(self.update_grep_log_info)
-        self.thread_reference_list.append(thread)
-        thread.start()
+        def create_grep_log_thread():
+            thread = GrepLogThread(self.repo, self.repo.head, keyword)
+            thread.fetch_result.connect(self.update_grep_log_info)
+            thread.progress_result.connect(self.update_grep_log_progress)
+            thread.finish_result.connect(self.finish_grep_log)
+            return thread
+
+        # Previous grep is cancelled by scheduler.
+        self.refresh_scheduler.schedule("grep_log", create_grep_log_thread)
 
     @PostGui()
-    def update_grep_log_info(self, keyword, branch_name, log, search_cache_path):
-        if self.search_log_cache_path != "" and os.path.exists(self.search_log_cache_path):
-            if self.search_log_cache_path not in self.temp_files:
-                self.temp_files.append(self.search_log_cache_path)
+    def update_grep_log_info(self, branch_name, log_pager, offset, count):
+        if offset == 0:
+            self.log_pager = log_pager
+            self.log_search_index = log_pager.search_index
+            self.buffer_widget.eval_js_function("updateLogInfo", branch_name, log_pager.get_page(0, count))
+        elif self.log_pager is log_pager:
+            self.buffer_widget.eval_js_function("appendLogPage", branch_name, log_pager.get_page(offset, count))
 
-        self.search_log_cache_path = search_cache_path
-        self.buffer_widget.eval_js_function("updateLogInfo", branch_name, log)
+    @PostGui()
+    def update_grep_log_progress(self, keyword, scanned, total):
+        message_to_emacs(f"Grep log with keyword: {keyword}... {scanned}/{total}")
+
+    @PostGui()
+    def finish_grep_log(self, keyword, branch_name, log_pager):
+        if self.log_pager is log_pager:
+            self.buffer_widget.eval_js_function("updateLogTotal", branch_name, len(log_pager))
 
-        message_to_emacs(f"Find log match keyword: {keyword}")
+            message_to_emacs(f"Find log match keyword: {keyword}")
 
     def fetch_stash_info(self):
+        self.refresh_scheduler.schedule("stash", self.create_fetch_stash_thread)
+
+    def create_fetch_stash_thread(self):
         thread = FetchStashThread(self.repo)
         thread.fetch_result.connect(self.update_stash_info)
-        self.thread_reference_list.append(thread)
-        thread.start()
+        return thread
 
     @PostGui()
     def update_stash_info(self, stash):
         self.buffer_widget.eval_js_function("updateStashInfo", stash)
 
     def fetch_submodule_info(self):
+        self.refresh_scheduler.schedule("submodule", self.create_fetch_submodule_thread)
+
+    def create_fetch_submodule_thread(self):
         thread = FetchSubmoduleThread(self.repo, self.repo_root)
         thread.fetch_result.connect(self.update_submodule_info)
-        self.thread_reference_list.append(thread)
-        thread.start()
+        return thread
 
     @PostGui()
-    def update_submodule_info(self, submodule, search_cache_path):
-        if self.search_submodule_cache_path != "" and os.path.exists(self.search_submodule_cache_path):
-            if self.search_submodule_cache_path not in self.temp_files:
-                self.temp_files.append(self.search_submodule_cache_path)
-
-        self.search_submodule_cache_path = search_cache_path
+    def update_submodule_info(self, submodule, search_index):
+        self.submodule_search_index = search_index
         self.buffer_widget.eval_js_function("updateSubmoduleInfo", submodule, True)
 
     def fetch_branch_info(self):
+        self.refresh_scheduler.schedule("branch", self.create_fetch_branch_thread)
+
+    def create_fetch_branch_thread(self):
         thread = FetchBranchThread(self.repo)
         thread.fetch_result.connect(self.update_branch_info)
-        self.thread_reference_list.append(thread)
-        thread.start()
+        return thread
 
     @PostGui()
     def update_branch_info(self, branch_list, remote_branch):
@@ -498,14 +1128,6 @@ class AppBuffer(BrowserBuffer):
             self.search_submodule_count = 0
             self.send_input_message("Search submodule: ", "search_submodule", "search")
 
-    def search_match_lines(self, search_string, cache_file_path):
-        import subprocess
-
-        command = "rg '{}' {} --color='never' --line-number --smart-case -o --replace=''".format(search_string, cache_file_path)
-        result = subprocess.run(command, shell=True, text=True, stdout=subprocess.PIPE)
-
-        return list(map(lambda x: int(x[:-1]) - 1, result.stdout.split()))
-
     def handle_search_log(self, search_string):
         in_minibuffer = get_emacs_func_result("minibufferp", [])
 
@@ -528,18 +1150,18 @@ class AppBuffer(BrowserBuffer):
 
     def try_search_log(self, count, search_string):
         if count == self.search_log_count and search_string.strip() != "":
-            if self.search_log_cache_path and os.path.exists(self.search_log_cache_path):
+            if self.log_search_index is not None:
                 self.buffer_widget.eval_js_function("searchLogsStart",
                     search_string,
-                    self.search_match_lines(search_string, self.search_log_cache_path))
+                    self.log_search_index.search(search_string))
 
     def try_search_submodule(self, count, search_string):
         if count == self.search_submodule_count and search_string.strip() != "":
-            if self.search_submodule_cache_path and os.path.exists(self.search_submodule_cache_path):
+            if self.submodule_search_index is not None:
                 self.buffer_widget.eval_js_function(
                     "searchSubmodulesStart",
                     search_string,
-                    self.search_match_lines(search_string, self.search_submodule_cache_path))
+                    self.submodule_search_index.search(search_string))
 
     @PostGui()
     def handle_search_forward(self, callback_tag):
@@ -573,8 +1195,7 @@ class AppBuffer(BrowserBuffer):
 
     @QtCore.pyqtSlot()
     def status_fetch_pr(self):
-        remote_default = next(self.repo.config.get_multivar("remote.pushdefault"), "origin")
-        origin_url = get_git_https_url(self.repo.remotes[remote_default].url)
+        origin_url = get_git_https_url(self.repo.remotes[get_push_remote_name(self.repo)].url)
 
         message_to_emacs("Fetch PR list...")
 
@@ -602,8 +1223,9 @@ class AppBuffer(BrowserBuffer):
 
             message_to_emacs("Fetch PR {} ...".format(pr_number))
 
-            get_command_result("cd {}; git fetch origin pull/{}/head:pr_{} && git checkout pr_{}".format(
+            get_command_result("cd {}; git fetch {} pull/{}/head:pr_{} && git checkout pr_{}".format(
                 self.repo_root,
+                get_push_remote_name(self.repo),
                 pr_number,
                 pr_number,
                 pr_number))
@@ -616,8 +1238,7 @@ class AppBuffer(BrowserBuffer):
 
     @QtCore.pyqtSlot()
     def remote_copy_url(self):
-        remote_default = next(self.repo.config.get_multivar("remote.pushdefault"), "origin")
-        origin_url = get_git_https_url(self.repo.remotes[remote_default].url)
+        origin_url = get_git_https_url(self.repo.remotes[get_push_remote_name(self.repo)].url)
 
         eval_in_emacs('kill-new', [origin_url])
         message_to_emacs("Copy {}".format(origin_url))
@@ -681,7 +1302,7 @@ class AppBuffer(BrowserBuffer):
     @QtCore.pyqtSlot(str)
     def log_revert_commit(self, commit_id):
         self.revert_commit = self.repo.revparse_single(commit_id)
-        self.send_input_message("Revert commit '{}' {}".format(commit_id, bytes_decode(self.revert_commit.raw_message)), "log_revert_commit", "yes-or-no")
+        self.send_input_message("Revert commit '{}' {}".format(commit_id, bytes_decode(self.revert_commit.raw_message, self.revert_commit.message_encoding)), "log_revert_commit", "yes-or-no")
 
     def handle_log_revert_commit(self):
         head = self.repo.head.peel()
@@ -692,7 +1313,7 @@ class AppBuffer(BrowserBuffer):
             revert_index = self.repo.revert_commit(self.revert_commit, head, 1)
 
         parent, ref = self.repo.resolve_refish(refish=self.repo.head.name)
-        commit_message = bytes_decode(self.revert_commit.raw_message)
+        commit_message = bytes_decode(self.revert_commit.raw_message, self.revert_commit.message_encoding)
         self.repo.create_commit(
             ref.name,
             self.repo.default_signature,
@@ -712,7 +1333,7 @@ class AppBuffer(BrowserBuffer):
 
     def handle_log_revert_to_commit(self, revert_message):
         short_commit_id = str(self.revert_to_commit.id)[:7]
-        revert_to_message = bytes_decode(self.revert_to_commit.raw_message).splitlines()[0]
+        revert_to_message = bytes_decode(self.revert_to_commit.raw_message, self.revert_to_commit.message_encoding).splitlines()[0]
         result = get_command_result("cd {}; git revert --no-edit -n {}..HEAD".format(self.repo_root, short_commit_id))
 
         if result == "":
@@ -749,7 +1370,7 @@ class AppBuffer(BrowserBuffer):
             self.fetch_stash_info()
 
             last_commit = self.repo.revparse_single(str(self.repo.head.target))
-            message_to_emacs("Current HEAD is: {}".format(bytes_decode(last_commit.raw_message)).splitlines()[0])
+            message_to_emacs("Current HEAD is: {}".format(bytes_decode(last_commit.raw_message, last_commit.message_encoding)).splitlines()[0])
 
     @QtCore.pyqtSlot(str, str)
     def log_reset_to(self, commit_id, commit_message):
@@ -884,20 +1505,6 @@ class AppBuffer(BrowserBuffer):
         self.fetch_stash_info()
         self.fetch_status_info()
 
-    def highlight_diff(self, content):
-        from pygments import highlight
-        from pygments.formatters import HtmlFormatter
-        from pygments.lexers import guess_lexer
-
-        return highlight(content, guess_lexer(content), HtmlFormatter(full=True, style=self.highlight_style))
-
-    def highlight_diff_strict(self, content):
-        from pygments import highlight
-        from pygments.formatters import HtmlFormatter
-        from pygments.lexers import DiffLexer
-
-        return highlight(content, DiffLexer(), HtmlFormatter(full=True, style=self.highlight_style))
-
     @QtCore.pyqtSlot(str, str)
     def update_diff(self, type, file):
         import time
@@ -906,16 +1513,45 @@ class AppBuffer(BrowserBuffer):
         self.diff_type = type
         self.diff_file = file
         self.diff_tick = tick
+        self.diff_pending = None
         thread = HighlightDiffThread(self, type, file, tick)
         thread.fetch_result.connect(self.render_diff)
+        self.start_diff_thread(thread)
+
+    @QtCore.pyqtSlot()
+    def status_show_more_diff(self):
+        if self.diff_pending is not None:
+            thread = HighlightDiffThread(self, self.diff_type, self.diff_file, self.diff_tick, self.diff_pending)
+            self.diff_pending = None
+            self.start_diff_thread(thread)
+        else:
+            message_to_emacs("Whole diff is shown.")
+
+    def start_diff_thread(self, thread):
+        thread.append_result.connect(self.append_diff)
+        thread.finish_result.connect(self.finish_diff)
         self.thread_reference_list.append(thread)
         thread.start()
 
+    def is_current_diff(self, type, file, tick):
+        return self.diff_type == type and self.diff_file == file and self.diff_tick == tick
+
     @PostGui()
     def render_diff(self, type, file, tick, diff_string, patch_set):
-        if self.diff_type == type and self.diff_file == file and self.diff_tick == tick:
+        if self.is_current_diff(type, file, tick):
             self.buffer_widget.eval_js_function("updateChangeDiff", type, {"diff": diff_string, "patch_set": patch_set})
 
+    @PostGui()
+    def append_diff(self, type, file, tick, patch_set):
+        if self.is_current_diff(type, file, tick):
+            self.buffer_widget.eval_js_function("appendChangeDiff", patch_set)
+
+    @PostGui()
+    def finish_diff(self, type, file, tick, pending, hidden_lines):
+        if self.is_current_diff(type, file, tick):
+            self.diff_pending = pending
+            self.buffer_widget.eval_js_function("finishChangeDiff", hidden_lines)
+
     @QtCore.pyqtSlot()
     def status_commit_stage(self):
         if len(self.stage_status) > 0:
@@ -962,27 +1598,27 @@ class AppBuffer(BrowserBuffer):
             return
         
         if type == "untrack":
-            self.status_open_file(self.untrack_status[file_index]["file"])
+            self.status_open_file(self.untrack_status[file_index].file)
         elif type in ["unstage", "stage"]:
-            # Select the appropriate status list and cache parameter based on type
+            # Select the appropriate status list based on type
             status_list = self.unstage_status if type == "unstage" else self.stage_status
-            cached = False if type == "unstage" else True
             
             # Get file path
-            filepath = os.path.join(self.repo_root, status_list[file_index]["file"])
+            filepath = os.path.join(self.repo_root, status_list[file_index].file)
             
             try:
-                # Get diff information
-                diff = self.repo.diff(cached=cached)
-                line_number = self._find_first_diff_line(diff, status_list[file_index]["file"])
+                # Get diff information of selected file only
+                patch_data = get_file_patch_data(self.repo, type, status_list[file_index].file)
+                diff = pygit2.Diff.parse_diff(b"".join(patch_data))
+                line_number = self._find_first_diff_line(diff, status_list[file_index].file)
                 
                 if line_number is not None:
                     # Directly call Elisp function to open file and jump to the specified line
                     eval_in_emacs('eaf-git-find-file-and-goto-line', [filepath, str(line_number)])
                 else:
-                    self.status_open_file(status_list[file_index]["file"])
+                    self.status_open_file(status_list[file_index].file)
             except Exception as e:
-                self.status_open_file(status_list[file_index]["file"])
+                self.status_open_file(status_list[file_index].file)
 
     def status_open_file(self, filename):
         filepath = os.path.join(self.repo_root, filename)
@@ -1072,12 +1708,16 @@ class AppBuffer(BrowserBuffer):
 
         try:
             expand_path = os.path.join(self.repo_root, path)
-            if os.path.exists(expand_path):
+            if os.path.isdir(expand_path):
+                # Collapsed untracked directory.
+                index.add_all([path])
+            elif os.path.exists(expand_path):
                 index.add(path)
             else:
                 index.remove(path)
 
             index.write()
+            self.worktree_watcher.sync_index()
         except Exception:
             import traceback
             message_to_emacs(traceback.format_exc())
@@ -1099,6 +1739,7 @@ class AppBuffer(BrowserBuffer):
 
         # Write index
         index.write()
+        self.worktree_watcher.sync_index()
 
     def git_checkout_file(self, paths=[]):
         checkout_file_paths = list(map(lambda p: os.path.join(self.repo_root, p), paths))
@@ -1152,7 +1793,7 @@ class AppBuffer(BrowserBuffer):
         untrack_status = self.untrack_status
 
         for file_info in untrack_status:
-            self.git_add_file(file_info["file"])
+            self.git_add_file(file_info.file)
 
         self.fetch_status_info(True)
 
@@ -1160,7 +1801,7 @@ class AppBuffer(BrowserBuffer):
         unstage_status = self.unstage_status
 
         for file_info in unstage_status:
-            self.git_add_file(file_info["file"])
+            self.git_add_file(file_info.file)
 
         self.fetch_status_info(True)
 
@@ -1168,7 +1809,7 @@ class AppBuffer(BrowserBuffer):
         stage_status = self.stage_status
 
         for file_info in stage_status:
-            self.git_reset_file(file_info["file"])
+            self.git_reset_file(file_info.file)
 
         self.fetch_status_info(True)
 
@@ -1178,12 +1819,15 @@ class AppBuffer(BrowserBuffer):
         stage_status = self.stage_status
         refresh_status = False
 
-        self.git_add_file(file_info["file"])
+        self.git_add_file(file_info.file)
 
-        if not status_is_include(stage_status, file_info):
+        if file_info.is_directory():
+            # Staged directory need split to files.
+            refresh_status = True
+        else:
             stage_status.append(file_info)
-        untrack_file_index = untrack_status.index(file_info)
-        untrack_status.remove(file_info)
+        untrack_file_index = untrack_status.index(file_info.file)
+        untrack_status.remove(file_info.file)
 
         select_item_type = ""
         select_item_index = -1
@@ -1195,25 +1839,22 @@ class AppBuffer(BrowserBuffer):
         else:
             select_item_type = "stage"
 
-        self.buffer_widget.eval_js_function("updateSelectInfo", stage_status, unstage_status, untrack_status, select_item_type, select_item_index)
+        self.send_status_info(select_item_type, select_item_index)
 
         if refresh_status:
             self.fetch_status_info()
 
     def stage_unstage_file(self, file_info):
-        untrack_status = self.untrack_status
         unstage_status = self.unstage_status
         stage_status = self.stage_status
         refresh_status = False
 
-        self.git_add_file(file_info["file"])
+        self.git_add_file(file_info.file)
 
-        if status_is_include(stage_status, file_info):
+        if not stage_status.append(file_info):
             refresh_status = True
-        else:
-            stage_status.append(file_info)
-        unstage_file_index = unstage_status.index(file_info)
-        unstage_status.remove(file_info)
+        unstage_file_index = unstage_status.index(file_info.file)
+        unstage_status.remove(file_info.file)
 
         select_item_type = ""
         select_item_index = -1
@@ -1223,7 +1864,7 @@ class AppBuffer(BrowserBuffer):
         else:
             select_item_type = "stage"
 
-        self.buffer_widget.eval_js_function("updateSelectInfo", stage_status, unstage_status, untrack_status, select_item_type, select_item_index)
+        self.send_status_info(select_item_type, select_item_index)
 
         if refresh_status:
             self.fetch_status_info()
@@ -1234,26 +1875,22 @@ class AppBuffer(BrowserBuffer):
         stage_status = self.stage_status
         refresh_status = False
 
-        self.git_reset_file(file_info["file"])
+        self.git_reset_file(file_info.file)
 
         stage_file_index = 0
 
         # Use try to get the type of file after unstaging
         try:
-            self.repo.revparse_single('HEAD').tree[file_info["file"]]
+            self.repo.revparse_single('HEAD').tree[file_info.file]
         except KeyError:
-            if status_is_include(untrack_status, file_info):
+            if not untrack_status.append(file_info):
                 refresh_status = True
-            else:
-                untrack_status.append(file_info)
         else:
-            if status_is_include(unstage_status, file_info):
+            if not unstage_status.append(file_info):
                 refresh_status = True
-            else:
-                unstage_status.append(file_info)
 
-        stage_file_index = stage_status.index(file_info)
-        stage_status.remove(file_info)
+        stage_file_index = stage_status.index(file_info.file)
+        stage_status.remove(file_info.file)
 
         select_item_type = ""
         select_item_index = -1
@@ -1265,7 +1902,7 @@ class AppBuffer(BrowserBuffer):
         elif len(untrack_status) > 0:
             select_item_type = "untrack"
 
-        self.buffer_widget.eval_js_function("updateSelectInfo", stage_status, unstage_status, untrack_status, select_item_type, select_item_index)
+        self.send_status_info(select_item_type, select_item_index)
 
         if refresh_status:
             self.fetch_status_info()
@@ -1290,29 +1927,27 @@ class AppBuffer(BrowserBuffer):
 
     def delete_untrack_file(self, file_info):
         self.delete_untrack_mark_file = file_info
-        self.send_input_message("Discard untracked changes in {}?".format(file_info["file"]), "delete_untrack_file", "yes-or-no")
+        self.send_input_message("Discard untracked changes in {}?".format(file_info.file), "delete_untrack_file", "yes-or-no")
 
     def delete_unstage_file(self, file_info):
         self.delete_unstage_mark_file = file_info
-        self.send_input_message("Discard unstaged changes in {}?".format(file_info["file"]), "delete_unstage_file", "yes-or-no")
+        self.send_input_message("Discard unstaged changes in {}?".format(file_info.file), "delete_unstage_file", "yes-or-no")
 
     def delete_stage_file(self, file_info):
         self.delete_stage_mark_file = file_info
-        self.send_input_message("Discard staged changes in {}?".format(file_info["file"]), "delete_stage_file", "yes-or-no")
+        self.send_input_message("Discard staged changes in {}?".format(file_info.file), "delete_stage_file", "yes-or-no")
 
     def handle_delete_untrack_files(self):
-        untrack_status = self.untrack_status
         unstage_status = self.unstage_status
-        stage_status = self.stage_status
 
         delete_file_number = len(self.untrack_status)
 
         for untrack_file in self.untrack_status:
-            untrack_path = os.path.join(self.repo_root, untrack_file["file"])
-            os.remove(untrack_path)
+            untrack_path = os.path.join(self.repo_root, untrack_file.file)
+            self.remove_untrack_path(untrack_path)
             self.clean_dir_without_files(untrack_path)
 
-        untrack_status = []
+        self.untrack_status = StatusList()
 
         select_item_type = ""
         select_item_index = -1
@@ -1321,7 +1956,7 @@ class AppBuffer(BrowserBuffer):
         else:
             select_item_type = "stage"
 
-        self.buffer_widget.eval_js_function("updateSelectInfo", stage_status, unstage_status, untrack_status, select_item_type, select_item_index)
+        self.send_status_info(select_item_type, select_item_index)
 
         if delete_file_number > 1:
             message_to_emacs("Delete {} files.".format(delete_file_number))
@@ -1331,12 +1966,11 @@ class AppBuffer(BrowserBuffer):
     def handle_delete_unstage_files(self):
         untrack_status = self.untrack_status
         unstage_status = self.unstage_status
-        stage_status = self.stage_status
 
         for file_info in unstage_status:
-            self.git_checkout_file([file_info["file"]])
+            self.git_checkout_file([file_info.file])
 
-        unstage_status = []
+        self.unstage_status = StatusList()
 
         select_item_type = ""
         select_item_index = -1
@@ -1345,7 +1979,7 @@ class AppBuffer(BrowserBuffer):
         else:
             select_item_type = "stage"
 
-        self.buffer_widget.eval_js_function("updateSelectInfo", stage_status, unstage_status, untrack_status, select_item_type, select_item_index)
+        self.send_status_info(select_item_type, select_item_index)
 
     def handle_delete_stage_files(self):
         untrack_status = self.untrack_status
@@ -1353,10 +1987,10 @@ class AppBuffer(BrowserBuffer):
         stage_status = self.stage_status
 
         for file_info in stage_status:
-            self.git_reset_file(file_info["file"])
-            self.git_checkout_file([file_info["file"]])
+            self.git_reset_file(file_info.file)
+            self.git_checkout_file([file_info.file])
 
-        stage_status = []
+        self.stage_status = StatusList()
 
         select_item_type = ""
         select_item_index = -1
@@ -1365,7 +1999,7 @@ class AppBuffer(BrowserBuffer):
         elif len(untrack_status) > 0:
             select_item_type = "untrack"
 
-        self.buffer_widget.eval_js_function("updateSelectInfo", stage_status, unstage_status, untrack_status, select_item_type, select_item_index)
+        self.send_status_info(select_item_type, select_item_index)
 
     def handle_commit_stage_files(self, message):
         self.handle_commit(message)
@@ -1374,9 +2008,8 @@ class AppBuffer(BrowserBuffer):
 
         untrack_status = self.untrack_status
         unstage_status = self.unstage_status
-        stage_status = self.stage_status
 
-        stage_status = []
+        self.stage_status = StatusList()
 
         select_item_type = ""
         select_item_index = -1
@@ -1385,7 +2018,7 @@ class AppBuffer(BrowserBuffer):
         elif len(untrack_status) > 0:
             select_item_type = "untrack"
 
-        self.buffer_widget.eval_js_function("updateSelectInfo", stage_status, unstage_status, untrack_status, select_item_type, select_item_index)
+        self.send_status_info(select_item_type, select_item_index)
 
         message_to_emacs("Commit stage files with: {}".format(message))
 
@@ -1399,7 +2032,10 @@ class AppBuffer(BrowserBuffer):
             self.fetch_log_info()
             self.fetch_submodule_info()
 
-            self.buffer_widget.eval_js_function("updateSelectInfo", [], [], [], "", -1)
+            self.stage_status = StatusList()
+            self.unstage_status = StatusList()
+            self.untrack_status = StatusList()
+            self.send_status_info("", -1)
 
             message_to_emacs("Commit stage files with: {}".format(message))
 
@@ -1435,6 +2071,12 @@ class AppBuffer(BrowserBuffer):
         if self.handle_commit_all_files(message):
             self.status_push()
 
+    def remove_untrack_path(self, path):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
     def clean_dir_without_files(self, begin_path):
         # only clean directory inside repo directory.
         begin_path = os.path.abspath(begin_path)
@@ -1453,12 +2095,11 @@ class AppBuffer(BrowserBuffer):
     def handle_delete_untrack_file(self):
         untrack_status = self.untrack_status
         unstage_status = self.unstage_status
-        stage_status = self.stage_status
 
-        untrack_file_index = untrack_status.index(self.delete_untrack_mark_file)
-        untrack_status.remove(self.delete_untrack_mark_file)
-        untrack_path = os.path.join(self.repo_root, self.delete_untrack_mark_file["file"])
-        os.remove(untrack_path)
+        untrack_file_index = untrack_status.index(self.delete_untrack_mark_file.file)
+        untrack_status.remove(self.delete_untrack_mark_file.file)
+        untrack_path = os.path.join(self.repo_root, self.delete_untrack_mark_file.file)
+        self.remove_untrack_path(untrack_path)
         self.clean_dir_without_files(untrack_path)
 
         select_item_type = ""
@@ -1471,19 +2112,17 @@ class AppBuffer(BrowserBuffer):
         else:
             select_item_type = "stage"
 
-        self.buffer_widget.eval_js_function("updateSelectInfo", stage_status, unstage_status, untrack_status, select_item_type, select_item_index)
+        self.send_status_info(select_item_type, select_item_index)
 
-        message_to_emacs("Delete file {}".format(self.delete_untrack_mark_file["file"]))
+        message_to_emacs("Delete file {}".format(self.delete_untrack_mark_file.file))
 
     def handle_delete_unstage_file(self):
-        untrack_status = self.untrack_status
         unstage_status = self.unstage_status
-        stage_status = self.stage_status
 
-        self.git_checkout_file([self.delete_unstage_mark_file["file"]])
+        self.git_checkout_file([self.delete_unstage_mark_file.file])
 
-        unstage_file_index = unstage_status.index(self.delete_unstage_mark_file)
-        unstage_status.remove(self.delete_unstage_mark_file)
+        unstage_file_index = unstage_status.index(self.delete_unstage_mark_file.file)
+        unstage_status.remove(self.delete_unstage_mark_file.file)
 
         select_item_type = ""
         select_item_index = -1
@@ -1493,18 +2132,18 @@ class AppBuffer(BrowserBuffer):
         else:
             select_item_type = "stage"
 
-        self.buffer_widget.eval_js_function("updateSelectInfo", stage_status, unstage_status, untrack_status, select_item_type, select_item_index)
+        self.send_status_info(select_item_type, select_item_index)
 
     def handle_delete_stage_file(self):
         untrack_status = self.untrack_status
         unstage_status = self.unstage_status
         stage_status = self.stage_status
 
-        self.git_reset_file(self.delete_stage_mark_file["file"])
-        self.git_checkout_file([self.delete_stage_mark_file["file"]])
+        self.git_reset_file(self.delete_stage_mark_file.file)
+        self.git_checkout_file([self.delete_stage_mark_file.file])
 
-        stage_file_index = stage_status.index(self.delete_stage_mark_file)
-        stage_status.remove(self.delete_stage_mark_file)
+        stage_file_index = stage_status.index(self.delete_stage_mark_file.file)
+        stage_status.remove(self.delete_stage_mark_file.file)
 
         select_item_type = ""
         select_item_index = -1
@@ -1516,19 +2155,7 @@ class AppBuffer(BrowserBuffer):
         elif len(untrack_status) > 0:
             select_item_type = "untrack"
 
-        self.buffer_widget.eval_js_function("updateSelectInfo", stage_status, unstage_status, untrack_status, select_item_type, select_item_index)
-
-    @QtCore.pyqtSlot(list)
-    def vue_update_stage_status(self, stage_status):
-        self.stage_status = stage_status
-
-    @QtCore.pyqtSlot(list)
-    def vue_update_unstage_status(self, unstage_status):
-        self.unstage_status = unstage_status
-
-    @QtCore.pyqtSlot(list)
-    def vue_update_untrack_status(self, untrack_status):
-        self.untrack_status = untrack_status
+        self.send_status_info(select_item_type, select_item_index)
 
     @QtCore.pyqtSlot(list)
     def vue_update_branch_status(self, branch_status):
@@ -1538,6 +2165,9 @@ class AppBuffer(BrowserBuffer):
     def vue_update_nav_current_item(self, nav_current_item):
         self.nav_current_item = nav_current_item
 
+        if nav_current_item != "Log":
+            self.refresh_scheduler.cancel("grep_log")
+
     @QtCore.pyqtSlot()
     def status_pull(self):
         if not self.repo.head_is_unborn:
@@ -1574,14 +2204,13 @@ class AppBuffer(BrowserBuffer):
 
     @QtCore.pyqtSlot()
     def open_in_browser(self):
-        remote_default = next(self.repo.config.get_multivar("remote.pushdefault"), "origin")
-        origin_url = get_git_https_url(self.repo.remotes[remote_default].url)
+        origin_url = get_git_https_url(self.repo.remotes[get_push_remote_name(self.repo)].url)
 
         eval_in_emacs("eaf-open-browser", [origin_url])
 
     @QtCore.pyqtSlot()
     def status_push(self):
-        self.handle_status_push("origin/{}".format(self.repo.head.shorthand))
+        self.handle_status_push("{}/{}".format(get_push_remote_name(self.repo), self.repo.head.shorthand))
 
     @QtCore.pyqtSlot()
     def status_checkout_all(self):
@@ -1605,7 +2234,10 @@ class AppBuffer(BrowserBuffer):
     def handle_checkout_all_files(self):
         self.git_checkout_file()
 
-        self.buffer_widget.eval_js_function("updateSelectInfo", [], [], [], "", -1)
+        self.stage_status = StatusList()
+        self.unstage_status = StatusList()
+        self.untrack_status = StatusList()
+        self.send_status_info("", -1)
 
         message_to_emacs("Checkout all.")
 
@@ -1617,7 +2249,8 @@ class AppBuffer(BrowserBuffer):
     @QtCore.pyqtSlot()
     def log_hide_compare_branch(self):
         self.log_compare_branch = ""
-        self.buffer_widget.eval_js_function("updateCompareLogInfo", "", [])
+        self.compare_log_pager = None
+        self.buffer_widget.eval_js_function("updateCompareLogInfo", "", get_log_batch(0, [], {}, 0, []), CompareLogThread.UNKNOWN_COMPARE_INFO)
         message_to_emacs("Hide compare branch.")
 
     @QtCore.pyqtSlot(list)
@@ -1915,9 +2548,9 @@ class AppBuffer(BrowserBuffer):
         self.send_input_message("Fetch remote branch: ", "branch_fetch", "list", completion_list=remote_branch_names)
 
     def handle_branch_fetch(self, remote_branch):
-        remote_branch = remote_branch.split("/")[-1]
+        (remote_name, remote_branch) = remote_branch.split("/", 1)
 
-        thread = GitFetchThread(self.repo_root, remote_branch)
+        thread = GitFetchThread(self.repo_root, remote_name, remote_branch)
         thread.fetch_result.connect(self.handle_branch_fetch_finish)
         self.thread_reference_list.append(thread)
         thread.start()
@@ -1963,8 +2596,7 @@ class AppBuffer(BrowserBuffer):
 
     @QtCore.pyqtSlot(str)
     def copy_commit_url(self, commit_id):
-        remote_default = next(self.repo.config.get_multivar("remote.pushdefault"), "origin")
-        origin_url = get_git_https_url(self.repo.remotes[remote_default].url)
+        origin_url = get_git_https_url(self.repo.remotes[get_push_remote_name(self.repo)].url)
 
         commit_url = "{}/commit/{}".format(origin_url, commit_id)
 
@@ -1973,11 +2605,6 @@ class AppBuffer(BrowserBuffer):
 
     @QtCore.pyqtSlot()
     def exit(self):
-        for file in self.temp_files:
-            if os.path.exists(file):
-                os.remove(file)
-        self.temp_files = []
-
         eval_in_emacs('eaf-git-exit', [self.repo_root])
 
     def _find_first_diff_line(self, diff, filepath):
@@ -2007,7 +2634,78 @@ class AppBuffer(BrowserBuffer):
         except Exception as e:
             return None
 
-class AddSubmoduleCallback(pygit2.RemoteCallbacks, QtCore.QObject):
+class RefreshScheduler:
+    """
+    Debounce fetch requests per panel, at most one worker runs for each panel.
+    Running worker is cancelled cooperatively when newer request arrives, unless request don't interrupt,
+    the newest request starts after running worker finished.
+    """
+
+    DEBOUNCE_INTERVAL = 50
+
+    def __init__(self, thread_reference_list):
+        self.thread_reference_list = thread_reference_list
+        self.timers = {}
+        self.pending_creators = {}
+        self.pending_interrupts = {}
+        self.running_threads = {}
+
+    def schedule(self, panel, create_thread, interrupt=True):
+        self.pending_creators[panel] = create_thread
+        self.pending_interrupts[panel] = self.pending_interrupts.get(panel, False) or interrupt
+
+        if panel not in self.timers:
+            timer = QTimer()
+            timer.setSingleShot(True)
+            timer.timeout.connect(lambda: self.start(panel))
+            self.timers[panel] = timer
+
+        self.timers[panel].start(self.DEBOUNCE_INTERVAL)
+
+    def start(self, panel):
+        running_thread = self.running_threads.get(panel)
+        if running_thread is not None and running_thread.isRunning():
+            if self.pending_interrupts.get(panel, False):
+                running_thread.requestInterruption()
+            return
+
+        create_thread = self.pending_creators.pop(panel, None)
+        self.pending_interrupts.pop(panel, None)
+        if create_thread is None:
+            return
+
+        thread = create_thread()
+        if thread is None:
+            return
+
+        thread.finished.connect(lambda: self.handle_finished(panel, thread))
+        self.running_threads[panel] = thread
+        self.thread_reference_list.append(thread)
+        thread.start()
+
+    def cancel(self, panel):
+        "Drop pending request and cancel running worker of panel."
+        self.pending_creators.pop(panel, None)
+        self.pending_interrupts.pop(panel, None)
+
+        if panel in self.timers:
+            self.timers[panel].stop()
+
+        running_thread = self.running_threads.get(panel)
+        if running_thread is not None and running_thread.isRunning():
+            running_thread.requestInterruption()
+
+    @PostGui()
+    def handle_finished(self, panel, thread):
+        if self.running_threads.get(panel) is thread:
+            self.running_threads.pop(panel)
+
+        if thread in self.thread_reference_list:
+            self.thread_reference_list.remove(thread)
+
+        self.start(panel)
+
+class AddSubmoduleCallback(pygit2.RemoteCallbacks, QtCore.QObject):
 
     finished = QtCore.pyqtSignal()
 
@@ -2044,140 +2742,555 @@ class AddSubmoduleThread(QThread):
             import traceback
             message_to_emacs(traceback.format_exc())
 
+class CommitLogCache:
+    """
+    Cache (id, commit_time, commit_time_offset, author, message) of commits of each branch,
+    a refresh only walk commits newer than cached tip of branch.
+    Records of recently fetched branches are kept in memory of buffer,
+    and optionally saved under git directory if cache_dir is set, so they are reused when open repository again.
+    Records are saved from oldest to newest, new commits are appended when branch moves forward.
+    """
+
+    # Cache file of old record format is ignored.
+    FORMAT_VERSION = 4
+
+    # Keep records of current branch and compare branch in memory.
+    MAX_MEMORY_REFS = 2
+
+    def __init__(self):
+        import threading
+
+        self.lock = threading.Lock()
+        self.cache_dir = None
+
+        # Ref name -> (records from newest to oldest, id of newest commit), dict order is used as LRU order.
+        self.memory_entries = {}
+
+    def get_cache_path(self, ref_name):
+        import hashlib
+        return os.path.join(self.cache_dir, "{}.v{}".format(hashlib.sha1(ref_name.encode("utf-8")).hexdigest(), self.FORMAT_VERSION))
+
+    def load(self, ref_name):
+        "Return records from newest to oldest and id of newest commit, return empty records if cache not exists or broken."
+        with self.lock:
+            entry = self.memory_entries.pop(ref_name, None)
+            if entry is not None:
+                self.memory_entries[ref_name] = entry
+                return entry
+
+        if self.cache_dir is None:
+            return ([], None)
+
+        records = []
+
+        try:
+            with open(self.get_cache_path(ref_name), "r", encoding="utf-8") as f:
+                for line in f:
+                    (id, commit_time, commit_time_offset, author, message) = line.rstrip("\n").split("\t", 4)
+                    records.append((id, int(commit_time), int(commit_time_offset), author, message))
+        except (OSError, ValueError):
+            return ([], None)
+
+        records.reverse()
+
+        return (records, records[0][0] if len(records) > 0 else None)
+
+    def save(self, ref_name, old_tip, records, new_count):
+        "Append newest new_count records if cache still end with old_tip, otherwise rewrite whole cache."
+        with self.lock:
+            self.memory_entries.pop(ref_name, None)
+            self.memory_entries[ref_name] = (records, records[0][0] if len(records) > 0 else None)
+            while len(self.memory_entries) > self.MAX_MEMORY_REFS:
+                self.memory_entries.pop(next(iter(self.memory_entries)))
+
+            if self.cache_dir is None:
+                return
+
+            cache_path = self.get_cache_path(ref_name)
+
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+
+                if old_tip is not None and self.read_tip(cache_path) == old_tip:
+                    with open(cache_path, "a", encoding="utf-8", errors="replace") as f:
+                        f.writelines(self.format_records(reversed(records[:new_count])))
+                else:
+                    temp_path = cache_path + ".tmp"
+                    with open(temp_path, "w", encoding="utf-8", errors="replace") as f:
+                        f.writelines(self.format_records(reversed(records)))
+                    os.replace(temp_path, cache_path)
+            except OSError:
+                import traceback
+                traceback.print_exc()
+
+    def prune(self, ref_names):
+        "Remove cache of deleted refs, and cache files of old record format."
+        with self.lock:
+            for ref_name in [ref_name for ref_name in self.memory_entries if ref_name not in ref_names]:
+                self.memory_entries.pop(ref_name)
+
+            if self.cache_dir is None:
+                return
+
+            keep_files = set(os.path.basename(self.get_cache_path(ref_name)) for ref_name in ref_names)
+
+            try:
+                for file_name in os.listdir(self.cache_dir):
+                    if file_name not in keep_files:
+                        os.remove(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                pass
+
+    def read_tip(self, cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 65536))
+                lines = f.read().splitlines()
+        except OSError:
+            return None
+
+        return lines[-1].split(b"\t", 1)[0].decode() if len(lines) > 0 else None
+
+    def format_records(self, records):
+        for (id, commit_time, commit_time_offset, author, message) in records:
+            yield "{}\t{}\t{}\t{}\t{}\n".format(id, commit_time, commit_time_offset, author, message)
+
+class SearchIndex:
+    """
+    Trigram index of search lines, lines can be added in batches while searching.
+    Narrowing search only check matches of previous search and lines added after it.
+    """
+
+    REGEX_SPECIAL_CHARS = set(".^$*+?{}[]\\|()")
+
+    def __init__(self):
+        import threading
+
+        self.lines = []
+        self.lower_lines = []
+        self.trigrams = {}
+        self.last_search = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def add(self, lines):
+        from array import array
+
+        with self.lock:
+            for line in lines:
+                line_index = len(self.lines)
+                lower_line = line.lower()
+                self.lines.append(line)
+                self.lower_lines.append(lower_line)
+
+                for trigram in {lower_line[i:i + 3] for i in range(len(lower_line) - 2)}:
+                    postings = self.trigrams.get(trigram)
+                    if postings is None:
+                        postings = self.trigrams[trigram] = array("I")
+                    postings.append(line_index)
+
+    def search(self, search_string):
+        "Return indexes of matched lines, search is case insensitive if search string is lower case."
+        ignore_case = search_string == search_string.lower()
+
+        with self.lock:
+            if any(char in self.REGEX_SPECIAL_CHARS for char in search_string):
+                self.last_search = None
+                return self.search_regex(search_string, ignore_case)
+
+            if ignore_case:
+                (keyword, lines) = (search_string.lower(), self.lower_lines)
+            else:
+                (keyword, lines) = (search_string, self.lines)
+
+            candidates = self.get_candidates(keyword, ignore_case)
+            matches = [line_index for line_index in candidates if keyword in lines[line_index]]
+            self.last_search = (keyword, ignore_case, len(self.lines), matches)
+
+            return matches
+
+    def get_candidates(self, keyword, ignore_case):
+        if self.last_search is not None:
+            (last_keyword, last_ignore_case, last_size, last_matches) = self.last_search
+            if last_ignore_case == ignore_case and last_keyword in keyword:
+                return last_matches + list(range(last_size, len(self.lines)))
+
+        lower_keyword = keyword.lower()
+        if len(lower_keyword) < 3:
+            return range(len(self.lines))
+
+        # Every matched line contains all trigrams of keyword, check lines of the rarest trigram.
+        candidates = None
+        for trigram in {lower_keyword[i:i + 3] for i in range(len(lower_keyword) - 2)}:
+            postings = self.trigrams.get(trigram)
+            if postings is None:
+                return []
+            elif candidates is None or len(postings) < len(candidates):
+                candidates = postings
+
+        return candidates
+
+    def search_regex(self, search_string, ignore_case):
+        import re
+
+        try:
+            pattern = re.compile(search_string, re.IGNORECASE if ignore_case else 0)
+        except re.error:
+            return []
+
+        return [line_index for (line_index, line) in enumerate(self.lines) if pattern.search(line)]
+
+class LogPager:
+    """
+    Serve log pages from resumable commit records iterator,
+    commits are only walked when page of them is requested.
+    Records of streaming worker are appended instead if iterator is None.
+    Only recently used pages of records are kept, evicted page is read from repository again by commit ids.
+    """
+
+    PAGE_SIZE = LOG_PAGE_SIZE
+    MAX_PAGES = 10
+
+    def __init__(self, repo, records_iter, search_index=None):
+        import threading
+
+        self.repo = repo
+        self.records_iter = records_iter
+        self.size = 0
+        self.finished = False
+        self.search_index = search_index
+        self.lock = threading.Lock()
+
+        # Raw ids of all records, 20 bytes each.
+        self.ids = bytearray()
+
+        # Page index -> records, dict order is used as LRU order.
+        self.pages = {}
+
+        # Authors are interned in order of first appearance,
+        # so author table of any prefix of records is same whatever pages are sent.
+        self.authors = []
+        self.author_indexes = {}
+        self.author_first_records = []
+
+    def __len__(self):
+        return self.size
+
+    def walk(self, count):
+        with self.lock:
+            self.walk_to(self.size + count)
+
+    def walk_to(self, size):
+        if self.records_iter is None:
+            return
+
+        records = []
+
+        try:
+            while not self.finished and self.size + len(records) < size:
+                records.append(next(self.records_iter))
+        except StopIteration:
+            self.finished = True
+        except KeyError:
+            import traceback
+            traceback.print_exc()
+
+            self.finished = True
+
+        self.add_records(records)
+
+    def append(self, records):
+        with self.lock:
+            self.add_records(records)
+
+    def add_records(self, records):
+        for (record_index, record) in enumerate(records, self.size):
+            author = record[3]
+            if author not in self.author_indexes:
+                self.author_indexes[author] = len(self.authors)
+                self.authors.append(author)
+                self.author_first_records.append(record_index)
+
+            self.ids += bytes.fromhex(record[0])
+
+            # Record of evicted page is not kept, whole page will be read again.
+            page_index = record_index // self.PAGE_SIZE
+            if record_index % self.PAGE_SIZE == 0:
+                self.pages[page_index] = [record]
+            elif page_index in self.pages:
+                self.pages[page_index].append(record)
+
+        self.size += len(records)
+        self.evict_pages()
+
+        if self.search_index is not None and len(records) > 0:
+            self.search_index.add(["{} {} {}".format(id, author, message) for (id, _, _, author, message) in records])
+
+    def evict_pages(self):
+        while len(self.pages) > self.MAX_PAGES:
+            self.pages.pop(next(iter(self.pages)))
+
+    def get_page_records(self, page_index):
+        page_start = page_index * self.PAGE_SIZE
+        page_end = min(page_start + self.PAGE_SIZE, self.size)
+
+        page = self.pages.pop(page_index, None)
+        if page is None or len(page) != page_end - page_start:
+            page = [get_commit_record(self.repo[Oid(raw=bytes(self.ids[record_index * 20:record_index * 20 + 20]))])
+                    for record_index in range(page_start, page_end)]
+
+        # Reinsert to move page to end.
+        self.pages[page_index] = page
+        self.evict_pages()
+
+        return page
+
+    def get_records(self, start, end):
+        records = []
+        for page_index in range(start // self.PAGE_SIZE, (end + self.PAGE_SIZE - 1) // self.PAGE_SIZE):
+            page_start = page_index * self.PAGE_SIZE
+            records += self.get_page_records(page_index)[max(start - page_start, 0):end - page_start]
+
+        return records
+
+    def get_page(self, offset, limit):
+        from bisect import bisect_left
+
+        with self.lock:
+            self.walk_to(offset + limit)
+            records = self.get_records(offset, min(offset + limit, self.size))
+
+            author_start = bisect_left(self.author_first_records, offset)
+            author_end = bisect_left(self.author_first_records, offset + len(records))
+
+            return get_log_batch(offset, records, self.author_indexes, author_start, self.authors[author_start:author_end])
+
+class FetchLogPageThread(QThread):
+
+    fetch_result = QtCore.pyqtSignal(str, object, object)
+
+    def __init__(self, log_pager, branch_name, offset, limit):
+        QThread.__init__(self)
+
+        self.log_pager = log_pager
+        self.branch_name = branch_name
+        self.offset = offset
+        self.limit = limit
+
+    def run(self):
+        self.fetch_result.emit(self.branch_name, self.log_pager, self.log_pager.get_page(self.offset, self.limit))
+
 class FetchLogThread(QThread):
 
-    fetch_result = QtCore.pyqtSignal(str, list, str, bool)
+    fetch_result = QtCore.pyqtSignal(str, object, object)
+    finish_result = QtCore.pyqtSignal(str, int)
 
-    def __init__(self, repo, branch, search_cache=False):
+    # Walk this number of commits between two interruption checks.
+    WALK_CHUNK_SIZE = 1000
+
+    def __init__(self, repo, branch, search_index=False, log_cache=None):
         QThread.__init__(self)
 
         self.repo = repo
         self.branch = branch
-        self.search_cache = search_cache
-        self.cache_file_path = ""
-        self.append = False
+        self.search_index = search_index
+        self.log_cache = log_cache
 
     def run(self):
-        git_log = []
+        pager = LogPager(self.repo, self.get_log_records(), SearchIndex() if self.search_index else None)
+        first_page = pager.get_page(0, LOG_PAGE_SIZE)
 
-        if self.search_cache:
-            import tempfile
-            self.cache_file = tempfile.NamedTemporaryFile(mode="w", delete=False)
-            self.cache_file_path = self.cache_file.name
+        if self.isInterruptionRequested():
+            # Superseded by newer fetch request.
+            return
 
-        start_time = datetime.datetime.now()
+        # Send first page immediately, later pages are fetched when log view scroll to them.
+        self.fetch_result.emit(self.branch.shorthand, pager, first_page)
 
-        cache_lines = []
-        try:
-            index = 0
+        if not self.search_index:
+            return
+
+        # Log search need all commits, keep walking and indexing in background,
+        # search index can answer search of walked commits before walk finish.
+        while not pager.finished:
+            if self.isInterruptionRequested():
+                return
+
+            pager.walk(self.WALK_CHUNK_SIZE)
 
+        self.finish_result.emit(self.branch.shorthand, len(pager))
+
+    def get_log_records(self):
+        "Yield (id, commit_time, commit_time_offset, author, message) of commits, newest first."
+        if self.log_cache is None:
             for commit in self.repo.walk(self.branch.target):
-                id = str(commit.id)
-                author = bytes_decode(commit.author.raw_name)
-                message_list = bytes_decode(commit.raw_message).splitlines()
-                message = message_list[0] if len(message_list) > 0 else ""
+                yield get_commit_record(commit)
+            return
 
-                git_log.append({
-                    "id": id,
-                    "index": index,
-                    "time": pretty_date(int(commit.commit_time)),
-                    "author": author,
-                    "message": message,
-                    "marked": "",
-                    "foregroundColor": "",
-                    "backgroundColor": ""
-                })
+        # Only walk commits newer than cached tip, the rest are loaded from cache.
+        tip = str(self.branch.target)
+        (cache_records, cache_tip) = self.log_cache.load(self.branch.name)
+        if cache_tip is not None and cache_tip != tip and not self.is_ancestor(cache_tip, tip):
+            # Branch is reset or rebased, walk whole history again.
+            (cache_records, cache_tip) = ([], None)
 
-                if self.search_cache:
-                    cache_lines.append("{} {} {}\n".format(id, author, message))
+        new_records = []
+        if cache_tip != tip:
+            walker = self.repo.walk(self.branch.target)
+            if cache_tip is not None:
+                walker.hide(Oid(hex=cache_tip))
 
-                index += 1
+            for commit in walker:
+                record = get_commit_record(commit)
+                new_records.append(record)
+                yield record
 
-                now = datetime.datetime.now()
-                if index == 50 or (now - start_time).total_seconds() > 30:
-                    start_time = now
-                    self.fetch_result.emit(self.branch.shorthand, git_log, self.cache_file_path, self.append)
+            self.log_cache.save(self.branch.name, cache_tip, new_records + cache_records, len(new_records))
+            # Log of detached HEAD is cached by name HEAD.
+            self.log_cache.prune(self.repo.listall_references() + ["HEAD"])
 
-                    # We need clean git_log after emit fetch_result signal,
-                    # make sure segmented sending log for super big project, such as, Emacs.
-                    git_log = []
-                    self.append = True
+        yield from cache_records
 
-        except KeyError:
-            import traceback
-            traceback.print_exc()
+    def is_ancestor(self, ancestor, commit):
+        try:
+            return self.repo.descendant_of(Oid(hex=commit), Oid(hex=ancestor))
+        except (KeyError, ValueError, GitError):
+            return False
+
+class CompareLogThread(FetchLogThread):
+    """
+    Fetch commits only in compare branch, then commits only in current branch, followed by merge base of two branches,
+    so JavaScript tag side of commit by its index and ahead count.
+    Shared history under merge base is already in log of current branch, so it's not walked again.
+    Fallback to walk whole compare branch if two branches have no merge base.
+    """
+
+    fetch_result = QtCore.pyqtSignal(str, object, object, object)
+
+    UNKNOWN_COMPARE_INFO = {"mergeBase": "", "ahead": -1, "behind": -1}
+
+    def __init__(self, repo, branch, head_branch, log_cache=None):
+        FetchLogThread.__init__(self, repo, branch, log_cache=log_cache)
+
+        self.head_branch = head_branch
+
+    def run(self):
+        compare_info = self.UNKNOWN_COMPARE_INFO
+
+        try:
+            merge_base = self.repo.merge_base(self.branch.target, self.head_branch.target)
+        except GitError:
+            merge_base = None
+
+        if merge_base is None:
+            records = self.get_log_records()
+        else:
+            # Count of commits only in compare branch or only in current branch, computed by libgit2.
+            (ahead, behind) = self.repo.ahead_behind(self.branch.target, self.head_branch.target)
+            compare_info = {"mergeBase": str(merge_base), "ahead": ahead, "behind": behind}
+            records = self.get_compare_records(merge_base)
+
+        pager = LogPager(self.repo, records)
+        first_page = pager.get_page(0, LOG_PAGE_SIZE)
 
-        # NOTE:
-        # Uncomment below code to test log search performance.
-        # git_log = git_log * 50
-        # cache_lines = cache_lines * 50
+        if not self.isInterruptionRequested():
+            self.fetch_result.emit(self.branch.shorthand, pager, first_page, compare_info)
 
-        if self.search_cache:
-            self.cache_file.writelines(cache_lines)
+    def get_compare_records(self, merge_base):
+        # Same commits as counted by ahead_behind.
+        for (target, hide_target) in ((self.branch.target, self.head_branch.target), (self.head_branch.target, self.branch.target)):
+            walker = self.repo.walk(target)
+            walker.hide(hide_target)
 
-        self.fetch_result.emit(self.branch.shorthand, git_log, self.cache_file_path, self.append)
+            for commit in walker:
+                yield get_commit_record(commit)
+
+        yield get_commit_record(self.repo[merge_base])
 
 class GrepLogThread(QThread):
 
-    fetch_result = QtCore.pyqtSignal(str, str, list, str)
+    fetch_result = QtCore.pyqtSignal(str, object, int, int)
+    progress_result = QtCore.pyqtSignal(str, int, int)
+    finish_result = QtCore.pyqtSignal(str, str, object)
+
+    # Number of commits send to grep worker process at once.
+    CHUNK_SIZE = 500
 
-    def __init__(self, repo, branch, keyword, search_cache=False):
+    def __init__(self, repo, branch, keyword):
         QThread.__init__(self)
 
         self.repo = repo
         self.branch = branch
         self.keyword = keyword
-        self.search_cache = search_cache
-        self.cache_file_path = ""
 
     def run(self):
-        git_log = []
+        from concurrent.futures.process import BrokenProcessPool
+
+        branch_name = self.branch.shorthand
+        pager = LogPager(self.repo, None, SearchIndex())
+        chunks = []
+        futures = []
 
-        if self.search_cache:
-            import tempfile
-            self.cache_file = tempfile.NamedTemporaryFile(mode="w", delete=False)
-            self.cache_file_path = self.cache_file.name
+        # Blob memo of chunks that grep in this thread, such as only one chunk or pool is broken.
+        blob_memo = {}
 
-        cache_lines = []
         try:
-            index = 0
+            commit_ids = [str(commit.id) for commit in self.repo.walk(self.branch.target) if commit.parents]
+            chunks = [commit_ids[i:i + self.CHUNK_SIZE] for i in range(0, len(commit_ids), self.CHUNK_SIZE)]
+
+            # Sending chunks to single worker is slower than grep in this thread.
+            if len(chunks) > 1 and grep_log_service.get_worker_count() > 1:
+                try:
+                    executor = grep_log_service.start()
+                    futures = [executor.submit(grep_log_commits, self.repo.path, self.keyword, chunk) for chunk in chunks]
+                except RuntimeError:
+                    # Pool is shutdown by last buffer, grep in this thread.
+                    futures = []
+
+            # Send matched commits chunk by chunk, keep commit order.
+            scanned = 0
+            for (chunk_index, chunk) in enumerate(chunks):
+                if chunk_index < len(futures):
+                    try:
+                        match_ids = futures[chunk_index].result()
+                    except (BrokenProcessPool, RuntimeError):
+                        # Worker is killed or pool is shutdown, restart pool for next grep and grep rest chunks in this thread.
+                        import traceback
+                        traceback.print_exc()
+
+                        grep_log_service.stop()
+                        futures = []
+                        match_ids = grep_log_commits(self.repo.path, self.keyword, chunk, blob_memo)
+                else:
+                    match_ids = grep_log_commits(self.repo.path, self.keyword, chunk, blob_memo)
+                scanned += len(chunk)
 
-            for commit in self.repo.walk(self.branch.target):
-                if commit.parents:
-                    parent = commit.parents[0]
-                    diff = self.repo.diff(parent, commit)
-
-                    for patch in diff:
-                        if self.keyword in patch.text:
-                            id = str(commit.id)
-                            author = bytes_decode(commit.author.raw_name)
-                            message = bytes_decode(commit.raw_message).splitlines()[0]
-
-                            git_log.append({
-                                "id": id,
-                                "index": index,
-                                "time": pretty_date(int(commit.commit_time)),
-                                "author": author,
-                                "message": message,
-                                "marked": "",
-                                "foregroundColor": "",
-                                "backgroundColor": ""
-                            })
-
-                            if self.search_cache:
-                                cache_lines.append("{} {} {}\n".format(id, author, message))
-
-                            index += 1
-
-                            break
-        except KeyError:
+                if self.isInterruptionRequested():
+                    return
+
+                offset = len(pager)
+                pager.append([get_commit_record(self.repo[commit_id]) for commit_id in match_ids])
+                if scanned == len(chunk) or len(match_ids) > 0:
+                    self.fetch_result.emit(branch_name, pager, offset, len(match_ids))
+
+                self.progress_result.emit(self.keyword, scanned, len(commit_ids))
+        except (KeyError, GitError):
             import traceback
             traceback.print_exc()
+        finally:
+            # Pool is shared, only cancel chunks of this grep.
+            for future in futures:
+                future.cancel()
 
-        if self.search_cache:
-            self.cache_file.writelines(cache_lines)
+        if len(chunks) == 0:
+            # Clear log view if no commit to grep.
+            self.fetch_result.emit(branch_name, pager, 0, 0)
 
-        self.fetch_result.emit(self.keyword, self.branch.shorthand, git_log, self.cache_file_path)
+        pager.finished = True
+        self.finish_result.emit(self.keyword, branch_name, pager)
 
 class FetchStashThread(QThread):
 
@@ -2205,11 +3318,12 @@ class FetchStashThread(QThread):
             import traceback
             traceback.print_exc()
 
-        self.fetch_result.emit(git_stash)
+        if not self.isInterruptionRequested():
+            self.fetch_result.emit(git_stash)
 
 class FetchSubmoduleThread(QThread):
 
-    fetch_result = QtCore.pyqtSignal(list, str)
+    fetch_result = QtCore.pyqtSignal(list, object)
 
     def __init__(self, repo, repo_root):
         QThread.__init__(self)
@@ -2222,13 +3336,12 @@ class FetchSubmoduleThread(QThread):
         submodule_infos = []
         submodule_names = self.repo.listall_submodules()
 
-        import tempfile
-        cache_file = tempfile.NamedTemporaryFile(mode="w", delete=False)
-        cache_file_path = cache_file.name
-
-        cache_lines = []
+        search_lines = []
 
         for submodule_name in submodule_names:
+            if self.isInterruptionRequested():
+                return
+
             if hasattr(self.repo, "lookup_submodule"):
                 submodule = self.repo.lookup_submodule(submodule_name)
             else:
@@ -2236,14 +3349,16 @@ class FetchSubmoduleThread(QThread):
             head_id = submodule.head_id.__str__()
 
             submodule_path = os.path.join(self.repo_root, submodule_name)
-            submodule_last_commit_date = ""
+            submodule_last_commit_time = None
+            submodule_last_commit_time_offset = 0
             submodule_last_commit_message = ""
 
             try:
                 submodule_repo = Repository(submodule_path)
                 submodule_last_commit = submodule_repo.revparse_single(str(submodule_repo.head.target))
-                submodule_last_commit_date = pretty_date(int(submodule_last_commit.commit_time))
-                submodule_last_commit_message = bytes_decode(submodule_last_commit.raw_message).splitlines()[0]
+                submodule_last_commit_time = int(submodule_last_commit.commit_time)
+                submodule_last_commit_time_offset = int(submodule_last_commit.commit_time_offset)
+                submodule_last_commit_message = bytes_decode(submodule_last_commit.raw_message, submodule_last_commit.message_encoding).splitlines()[0]
             except:
                 print("Fetch last commit date failed on submodule {}".format(submodule_path))
 
@@ -2252,18 +3367,21 @@ class FetchSubmoduleThread(QThread):
                 "name": submodule_name,
                 "path": submodule_path,
                 "head": submodule_last_commit_message,
-                "date": submodule_last_commit_date,
+                "date": "",
+                "timestamp": submodule_last_commit_time,
+                "timeOffset": submodule_last_commit_time_offset,
                 "head_id": head_id,
                 "foregroundColor": "",
                 "backgroundColor": ""
             })
 
-            cache_lines.append("{} {} {}\n".format(id, submodule_name, head_id))
+            search_lines.append("{} {}".format(submodule_name, head_id))
 
             index += 1
 
-        cache_file.writelines(cache_lines)
-        self.fetch_result.emit(submodule_infos, cache_file_path)
+        search_index = SearchIndex()
+        search_index.add(search_lines)
+        self.fetch_result.emit(submodule_infos, search_index)
 
 class FetchBranchThread(QThread):
 
@@ -2305,99 +3423,596 @@ class FetchBranchThread(QThread):
 
             index += 1
 
-        self.fetch_result.emit(local_branch_infos, remote_branch_infos)
+        if not self.isInterruptionRequested():
+            self.fetch_result.emit(local_branch_infos, remote_branch_infos)
+
+class DiffCache:
+    """
+    LRU cache of highlighted diff and hunk fragments, keyed by diff type, path,
+    blob ids or worktree file stat and highlight style, so unchanged diff is never rendered again.
+    """
+
+    MAX_ENTRIES = 200
+
+    # Total length of cached diff and hunk html.
+    MAX_SIZE = 32 * 1024 * 1024
+
+    def __init__(self):
+        import threading
+
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                # Reinsert to move entry to end, dict order is used as LRU order.
+                self.entries[key] = entry
+
+        return entry
+
+    def put(self, key, diff_string, hunks, fragments, raw_patch_set):
+        with self.lock:
+            old_entry = self.entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= old_entry[4]
+
+            size = len(diff_string) + sum(len(fragment) for fragment in fragments)
+            self.entries[key] = (diff_string, hunks, fragments, raw_patch_set, size)
+            self.size += size
+
+            while len(self.entries) > 1 and (len(self.entries) > self.MAX_ENTRIES or self.size > self.MAX_SIZE):
+                oldest_key = next(iter(self.entries))
+                self.size -= self.entries.pop(oldest_key)[4]
+
+class ProcessPoolService:
+    """
+    Long-lived spawn process pool shared by all buffers, it's created when first used and shutdown when last buffer is destroyed.
+    Spawned worker import EAF main module as __mp_main__ without running it, then import module of submitted function,
+    so worker never create Qt object and import cost is only paid when worker start.
+    Function submitted to pool should live in Qt-free module, such as utils.py.
+    """
+
+    WORKER_COUNT = 4
+
+    def __init__(self):
+        import threading
+
+        self.lock = threading.Lock()
+        self.executor = None
+        self.buffer_count = 0
+
+    def acquire(self):
+        with self.lock:
+            self.buffer_count += 1
+
+    def release(self):
+        with self.lock:
+            self.buffer_count -= 1
+            if self.buffer_count == 0:
+                self.shutdown_executor()
+
+    def start(self):
+        with self.lock:
+            return self.start_executor()
+
+    def start_executor(self):
+        if self.executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Spawn workers, fork is not safe in multi-threaded Qt process.
+            self.executor = ProcessPoolExecutor(max_workers=self.get_worker_count(), mp_context=multiprocessing.get_context("spawn"))
+
+        return self.executor
+
+    def get_worker_count(self):
+        return min(self.WORKER_COUNT, os.cpu_count() or 1)
+
+    def stop(self):
+        with self.lock:
+            self.shutdown_executor()
+
+    def shutdown_executor(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+class HighlightService(ProcessPoolService):
+    """
+    Highlight big diff in process pool, pygments hold GIL and will block status and log workers.
+    Few workers are warmed up after buffer created, so first big diff don't pay spawn cost.
+    """
+
+    # Diff smaller than this is highlighted in caller thread, sending it to worker cost more.
+    MIN_POOL_LINES = 2000
+
+    # Lines of hunks send to worker at once.
+    CHUNK_LINES = 1000
+
+    # Pool spawn worker when no worker is idle, every warm up task start one worker that import pygments.
+    WARM_WORKERS = 2
+
+    # Delay warm up after buffer created, don't slow down first status and log fetch.
+    WARM_UP_DELAY = 1000
+
+    def warm_up(self):
+        with self.lock:
+            # Last buffer is destroyed before warm up.
+            if self.buffer_count == 0:
+                return
+
+            executor = self.start_executor()
+            for _ in range(self.WARM_WORKERS):
+                executor.submit(highlight_diff_fragments, [""], "default")
+
+    def highlight(self, contents, style, strict=True):
+        "Highlight contents to HTML fragments, keep order of contents."
+        if sum(content.count("\n") for content in contents) < self.MIN_POOL_LINES:
+            return highlight_diff_fragments(contents, style, strict)
+
+        chunks = []
+        chunk = []
+        chunk_lines = 0
+        for content in contents:
+            chunk.append(content)
+            chunk_lines += content.count("\n")
+            if chunk_lines >= self.CHUNK_LINES:
+                chunks.append(chunk)
+                chunk = []
+                chunk_lines = 0
+        if len(chunk) > 0:
+            chunks.append(chunk)
+
+        from concurrent.futures.process import BrokenProcessPool
+
+        try:
+            executor = self.start()
+            futures = [executor.submit(highlight_diff_fragments, chunk, style, strict) for chunk in chunks]
+            return [fragment for future in futures for fragment in future.result()]
+        except (BrokenProcessPool, RuntimeError):
+            # Worker is killed or pool is shutdown, restart pool for next diff.
+            import traceback
+            traceback.print_exc()
+
+            self.stop()
+            return highlight_diff_fragments(contents, style, strict)
+
+highlight_service = HighlightService()
+
+class GrepLogService(ProcessPoolService):
+    """
+    Grep commits in process pool, diffing and searching blob content hold GIL, threads can't grep in parallel.
+    Every worker keep its blob memo, so later chunks and searches skip blobs that already checked.
+    """
+
+    WORKER_COUNT = 8
+
+grep_log_service = GrepLogService()
+
+class FileMetadataCache:
+    """
+    Cache mime, binary flag and line count of worktree files, keyed by (path, size, mtime_ns).
+    Unchanged files are never re-sniffed across status refreshes, and optionally across sessions.
+    """
+
+    # Keep most recently used entries when save to disk.
+    MAX_SAVE_ENTRIES = 50000
+
+    def __init__(self, mime_db):
+        import threading
+
+        self.mime_db = mime_db
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.cache_path = None
+
+    def get_entry(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                entry = {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns
+                }
+
+            # Reinsert to move entry to end, dict order is used as LRU order.
+            self.entries[path] = entry
+
+        return entry
+
+    def get_mime(self, path):
+        entry = self.get_entry(path)
+        if entry is None:
+            # Deleted file, guess mime by name.
+            return self.mime_db.mimeTypeForFile(path).name().replace("/", "-")
+
+        if "mime" not in entry:
+            entry["mime"] = self.mime_db.mimeTypeForFile(path).name().replace("/", "-")
+
+        return entry["mime"]
+
+    def is_binary(self, path):
+        entry = self.get_entry(path)
+        if entry is None:
+            return is_binary(path)
+
+        if "binary" not in entry:
+            entry["binary"] = is_binary(path)
+
+        return entry["binary"]
+
+    def get_line_count(self, path):
+        "Return line count and whether it is estimated from head of big file."
+        entry = self.get_entry(path)
+        if entry is None:
+            return (0, False)
+
+        if "line_count" not in entry:
+            (line_count, approximate) = count_file_lines(path)
+            entry["line_count"] = line_count
+            if approximate:
+                entry["line_count_approximate"] = True
+
+        return (entry["line_count"], entry.get("line_count_approximate", False))
+
+    def load(self, cache_path):
+        import json
+
+        self.cache_path = cache_path
+
+        try:
+            with open(cache_path, "r") as f:
+                entries = json.load(f)
+
+            with self.lock:
+                entries.update(self.entries)
+                self.entries = entries
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        import json
+
+        if self.cache_path is None:
+            return
+
+        with self.lock:
+            entries = dict(list(self.entries.items())[-self.MAX_SAVE_ENTRIES:])
+
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path, "w") as f:
+                json.dump(entries, f)
+        except OSError:
+            import traceback
+            traceback.print_exc()
+
+class WorktreeWatcher:
+    """
+    Record dirty paths of worktree through inotify (by watchdog),
+    then status refresh only need re-query those paths.
+    """
+
+    # Do full status refresh if too many paths changed, such as switch branch or build project.
+    MAX_DIRTY_PATHS = 1000
+
+    def __init__(self, repo, repo_root):
+        import threading
+
+        self.repo = repo
+        self.repo_root = os.path.abspath(repo_root)
+        self.git_dir = os.path.abspath(repo.path)
+
+        self.lock = threading.Lock()
+        self.observer = None
+        self.dirty_paths = set()
+        self.need_full_refresh = True
+        self.index_signature = None
+
+    def start(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            # Fallback to full status refresh if watchdog is not installed.
+            return
+
+        watcher = self
+
+        class WorktreeEventHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type in ["opened", "closed", "closed_no_write"]:
+                    return
+
+                watcher.mark_dirty(event.event_type, event.src_path, event.is_directory)
+                if getattr(event, "dest_path", ""):
+                    watcher.mark_dirty(event.event_type, event.dest_path, event.is_directory)
+
+        try:
+            self.observer = Observer()
+            self.observer.daemon = True
+            self.observer.schedule(WorktreeEventHandler(), self.repo_root, recursive=True)
+            self.observer.start()
+        except Exception:
+            import traceback
+            traceback.print_exc()
+
+            self.observer = None
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer = None
+
+    def mark_dirty(self, event_type, path, is_directory):
+        path = os.path.abspath(os.fsdecode(path))
+        if path == self.git_dir or path.startswith(self.git_dir + os.path.sep):
+            # Index and HEAD changes are checked by get_index_signature.
+            return
+
+        with self.lock:
+            if is_directory:
+                # Directory modified event is emitted for every child change,
+                # created/deleted/moved directory may contain many files, do full refresh.
+                if event_type != "modified":
+                    self.need_full_refresh = True
+            else:
+                self.dirty_paths.add(os.path.relpath(path, self.repo_root).replace(os.path.sep, "/"))
+
+                if len(self.dirty_paths) > self.MAX_DIRTY_PATHS:
+                    self.need_full_refresh = True
+
+    def get_index_signature(self):
+        try:
+            index_stat = os.stat(os.path.join(self.git_dir, "index"))
+            index_signature = (index_stat.st_mtime_ns, index_stat.st_size)
+        except OSError:
+            index_signature = None
+
+        try:
+            head_signature = self.repo.lookup_reference("HEAD").resolve().target
+        except (KeyError, GitError):
+            head_signature = None
+
+        return (index_signature, str(head_signature))
+
+    def sync(self):
+        with self.lock:
+            self.dirty_paths = set()
+            self.need_full_refresh = False
+
+        self.sync_index()
+
+    def sync_index(self):
+        self.index_signature = self.get_index_signature()
+
+    def take_dirty_paths(self):
+        """
+        Return dirty paths since last refresh, or None if need full status refresh.
+        """
+        if self.observer is None or not self.observer.is_alive():
+            return None
+
+        with self.lock:
+            if self.need_full_refresh:
+                return None
+
+            dirty_paths = self.dirty_paths
+            self.dirty_paths = set()
+
+        if self.get_index_signature() != self.index_signature:
+            return None
+
+        return dirty_paths
 
 class FetchStatusThread(QThread):
 
-    fetch_result = QtCore.pyqtSignal(list, list, list)
+    fetch_result = QtCore.pyqtSignal(object, object, object)
+    patch_result = QtCore.pyqtSignal(object, object, object, list)
 
-    def __init__(self, repo, repo_root, mime_db):
+    # Stop count files of collapsed untracked directory when reach this limit.
+    UNTRACK_DIRECTORY_COUNT_LIMIT = 1000
+
+    def __init__(self, repo, repo_root, file_metadata_cache, paths=None, collapse_directory=False, expand_directories=[], status_options=None):
         QThread.__init__(self)
 
         self.repo = repo
         self.repo_root = repo_root
-        self.mime_db = mime_db
+        self.file_metadata_cache = file_metadata_cache
+        self.paths = paths
+        self.collapse_directory = collapse_directory
+        self.expand_directories = expand_directories
+        self.status_options = status_options or {"ignore_submodules": False, "untracked_cache": False, "pathspecs": []}
+        self.fast_status = any(self.status_options.values())
 
     def run(self):
-        status = list(filter(lambda info: info[1] != GIT_STATUS_IGNORED, list(self.repo.status().items())))
+        if self.paths is None:
+            status = list(filter(lambda info: info[1] != GIT_STATUS_IGNORED and match_pathspecs(info[0], self.status_options["pathspecs"]),
+                                 list(self.fetch_repo_status().items())))
+            status = self.expand_untrack_directories(status)
+
+            if self.fast_status:
+                # Whole repository diff will walk all submodules and paths out of scope.
+                self.fetch_paths_line_stats([file for (file, file_status) in status if file_status != GIT_STATUS_WT_NEW])
+            else:
+                self.fetch_line_stats()
+        else:
+            status = self.expand_untrack_directories(self.fetch_paths_status())
+            self.paths = list(self.paths) + [file for (file, _) in status]
+
+            # Line count of untracked file come from metadata cache, don't read it here.
+            self.fetch_paths_line_stats([file for (file, file_status) in status if file_status != GIT_STATUS_WT_NEW])
+
+        if self.isInterruptionRequested():
+            return
 
         (stage_status, unstage_status, untrack_status) = self.parse_status(status)
 
-        self.fetch_result.emit(stage_status, unstage_status, untrack_status)
+        if self.isInterruptionRequested():
+            # Superseded by newer status request.
+            return
 
-    def parse_status(self, status):
-        stage_status = []
-        unstage_status = []
-        untrack_status = []
+        if self.paths is None:
+            self.fetch_result.emit(stage_status, unstage_status, untrack_status)
+        else:
+            self.patch_result.emit(stage_status, unstage_status, untrack_status, list(self.paths))
+
+    def fetch_repo_status(self):
+        if self.fast_status:
+            status = get_porcelain_status(self.repo_root,
+                                          "normal" if self.collapse_directory else "all",
+                                          self.status_options["ignore_submodules"],
+                                          self.status_options["untracked_cache"],
+                                          self.status_options["pathspecs"])
+            if status is not None:
+                return status
+
+        if self.collapse_directory:
+            try:
+                # Untracked directories are reported as one item end with "/".
+                return self.repo.status(untracked_files="normal")
+            except TypeError:
+                # Old pygit2 not support untracked_files option.
+                pass
 
-        for info in status:
-            if info[1] in GIT_STATUS_DICT:
-                self.append_file_to_status_list(info, info[1], stage_status, unstage_status, untrack_status)
+        return self.repo.status()
+
+    def expand_untrack_directories(self, status):
+        expand_status = []
+        for (file, file_status) in status:
+            if file.endswith("/") and file in self.expand_directories:
+                for path in get_untrack_directory_files(self.repo, self.repo_root, file):
+                    expand_status.append((path, GIT_STATUS_WT_NEW))
             else:
-                first_dict = GIT_STATUS_DICT
-                second_dict = GIT_STATUS_DICT
+                expand_status.append((file, file_status))
+
+        return expand_status
 
-                for first_key in first_dict:
-                    for second_key in second_dict:
-                        if info[1] == first_key | second_key:
-                            self.append_file_to_status_list(info, first_key, stage_status, unstage_status, untrack_status)
-                            self.append_file_to_status_list(info, second_key, stage_status, unstage_status, untrack_status)
+    def fetch_paths_status(self):
+        status = []
+        for path in sorted(self.paths):
+            if not match_pathspecs(path, self.status_options["pathspecs"]):
+                continue
+
+            if path.endswith("/"):
+                # Untracked directory.
+                if os.path.isdir(os.path.join(self.repo_root, path)):
+                    status.append((path, GIT_STATUS_WT_NEW))
+                continue
+
+            try:
+                file_status = self.repo.status_file(path)
+            except (KeyError, GitError):
+                # File is removed and not tracked by index.
+                continue
+
+            if file_status not in [GIT_STATUS_CURRENT, GIT_STATUS_IGNORED]:
+                status.append((path, file_status))
+
+        return status
+
+    def fetch_paths_line_stats(self, paths):
+        # Diff blobs of each path directly, avoid diff whole repository for few dirty paths.
+        index = self.repo.index
+        index.read(False)
+
+        try:
+            head_tree = self.repo.revparse_single("HEAD^{tree}")
+            self.stage_line_stats = {}
+        except KeyError:
+            head_tree = None
+            self.stage_line_stats = None
+
+        self.unstage_line_stats = {}
+
+        for path in paths:
+            index_blob = self.get_path_blob(index, path)
+
+            if head_tree is not None:
+                self.stage_line_stats[path] = get_blob_line_stats(self.get_path_blob(head_tree, path), index_blob)
+
+            file_path = os.path.join(self.repo_root, path)
+            if os.path.isfile(file_path):
+                with open(file_path, "rb") as f:
+                    self.unstage_line_stats[path] = get_blob_line_stats(index_blob, f.read())
+            else:
+                self.unstage_line_stats[path] = get_blob_line_stats(index_blob, None)
+
+    def get_path_blob(self, tree_or_index, path):
+        "Get blob of path, None if path not exists or it's not blob, such as submodule whose commit is not in this repository."
+        try:
+            blob = self.repo.get(tree_or_index[path].id)
+        except KeyError:
+            return None
+
+        return blob if isinstance(blob, pygit2.Blob) else None
+
+    def parse_status(self, status):
+        stage_status = StatusList()
+        unstage_status = StatusList()
+        untrack_status = StatusList()
+
+        for info in status:
+            for type_key in GIT_STATUS_FLAG_TABLE.get(info[1], ()):
+                self.append_file_to_status_list(info, type_key, stage_status, unstage_status, untrack_status)
 
         return (stage_status, unstage_status, untrack_status)
 
     def append_file_to_status_list(self, info, type_key, stage_status, unstage_status, untrack_status):
         file = info[0]
         file_path = os.path.join(self.repo_root, file)
-        mime = self.mime_db.mimeTypeForFile(file_path).name().replace("/", "-")
 
-        (add_count, delete_count) = self.get_line_info(file, type_key, mime)
+        if file.endswith("/"):
+            status = StatusEntry(file, GIT_STATUS_DICT[type_key], "inode-directory", 0, 0,
+                                 len(get_untrack_directory_files(self.repo, self.repo_root, file, self.UNTRACK_DIRECTORY_COUNT_LIMIT)))
+        else:
+            mime = self.file_metadata_cache.get_mime(file_path)
 
-        status = {
-            "file": file,
-            "type": GIT_STATUS_DICT[type_key],
-            "mime": mime,
-            "add_count": add_count,
-            "delete_count": delete_count
-        }
+            (add_count, delete_count, approximate) = self.get_line_info(file, type_key, mime)
+
+            status = StatusEntry(file, GIT_STATUS_DICT[type_key], mime, add_count, delete_count, approximate=approximate)
 
         if type_key in GIT_STATUS_INDEX_CHANGES:
-            if status not in stage_status:
-                stage_status.append(status)
+            stage_status.append(status)
         elif type_key in [GIT_STATUS_WT_NEW]:
-            if status not in untrack_status:
-                untrack_status.append(status)
+            untrack_status.append(status)
         else:
-            if status not in unstage_status:
-                unstage_status.append(status)
+            unstage_status.append(status)
 
-    def get_line_info(self, file, type_key, mime):
-        # Used to check if there's no commit in current repo.
-        head_unborn = False
+    def fetch_line_stats(self):
+        # Compute staged and unstaged diff only once per refresh,
+        # scan every patch of each diff per changed file is too slow for big refactors.
+        try:
+            head_tree = self.repo.revparse_single("HEAD^{tree}")
+            self.stage_line_stats = get_diff_line_stats(self.repo.index.diff_to_tree(head_tree))
+        except KeyError:
+            # Used to check if there's no commit in current repo.
+            self.stage_line_stats = None
 
-        if type_key in GIT_STATUS_INDEX_CHANGES:
-            try:
-                head_tree = self.repo.revparse_single("HEAD^{tree}")
-                stage_diff = self.repo.index.diff_to_tree(head_tree)
+        self.unstage_line_stats = get_diff_line_stats(self.repo.diff(cached=True))
 
-                patches = [patch for patch in stage_diff if patch.delta.new_file.path == file]
-                for patch in patches:
-                    (_, add_count, delete_count) = patch.line_stats
-                    return (add_count, delete_count)
-            except KeyError:
-                head_unborn = True
+    def get_line_info(self, file, type_key, mime):
+        head_unborn = self.stage_line_stats is None
+
+        if type_key in GIT_STATUS_INDEX_CHANGES and not head_unborn and file in self.stage_line_stats:
+            return self.stage_line_stats[file] + (False,)
 
         if type_key in [GIT_STATUS_WT_NEW] or head_unborn:
             if mime.startswith("text-"):
-                file_path =os.path.join(self.repo_root, file)
-                return (len(open(file_path, "r", encoding="utf-8", errors="ignore").readlines()), 0)
+                (line_count, approximate) = self.file_metadata_cache.get_line_count(os.path.join(self.repo_root, file))
+                return (line_count, 0, approximate)
             else:
-                return (0, 0)
+                return (0, 0, False)
         else:
-            unstage_diff = self.repo.diff(cached=True)
-            patches = [patch for patch in unstage_diff if patch.delta.new_file.path == file]
-            for patch in patches:
-                (_, add_count, delete_count) = patch.line_stats
-                return (add_count, delete_count)
+            return self.unstage_line_stats.get(file, (0, 0)) + (False,)
 
 class GitPullThread(QThread):
 
@@ -2483,44 +4098,97 @@ class GitFetchThread(QThread):
 
     fetch_result = QtCore.pyqtSignal(str, str)
 
-    def __init__(self, repo_root, remote_branch=None):
+    def __init__(self, repo_root, remote_name=None, remote_branch=None):
         QThread.__init__(self)
 
         self.repo_root = repo_root
+        self.remote_name = remote_name
         self.remote_branch = remote_branch
 
     def run(self):
         command = "cd {}; git fetch".format(self.repo_root)
         if self.remote_branch is not None:
-            command = "cd {}; git fetch origin {}".format(self.repo_root, self.remote_branch)
+            command = "cd {}; git fetch {} {}".format(self.repo_root, self.remote_name, self.remote_branch)
 
         self.fetch_result.emit(self.remote_branch, get_command_result(command).strip())
 
 class FetchUnpushThread(QThread):
+    """
+    Fetch unpushed commits and ahead/behind count of current branch to its upstream,
+    nothing is emitted if HEAD and upstream are not moved since last fetch.
+    """
 
-    fetch_result = QtCore.pyqtSignal(list)
+    fetch_result = QtCore.pyqtSignal(object, list, int, int)
 
-    def __init__(self, repo, repo_root):
+    # Only list this number of unpushed commits, ahead count is still exact.
+    UNPUSH_LIMIT = 100
+
+    def __init__(self, repo, last_unpush_key):
         QThread.__init__(self)
 
         self.repo = repo
-        self.repo_root = repo_root
+        self.last_unpush_key = last_unpush_key
 
     def run(self):
         if self.repo.head_is_unborn: return  # noqa: E701
 
-        import subprocess
-        result = subprocess.run(
-            "cd {}; git log origin/{}..HEAD --pretty=format:'%h %s'".format(self.repo_root, self.repo.head.shorthand),
-            shell=True, capture_output=True, text=True).stdout
+        head = self.repo.head
+        upstream = self.get_upstream(head)
+        if upstream is None:
+            unpush_key = (head.name, str(head.target), None, None)
+        else:
+            unpush_key = (head.name, str(head.target), upstream.name, str(upstream.target))
 
-        self.fetch_result.emit(list(filter(lambda x: x.strip() != "", result.split("\n"))))
+        if unpush_key == self.last_unpush_key:
+            return
+
+        unpush_list = []
+        (ahead, behind) = (-1, -1)
+
+        if upstream is not None:
+            try:
+                (ahead, behind) = self.repo.ahead_behind(head.target, upstream.target)
+
+                walker = self.repo.walk(head.target)
+                walker.hide(upstream.target)
+                for commit in walker:
+                    if len(unpush_list) >= self.UNPUSH_LIMIT:
+                        break
+
+                    (_, _, _, _, message) = get_commit_record(commit)
+                    unpush_list.append("{} {}".format(commit.short_id, message))
+            except (KeyError, GitError):
+                import traceback
+                traceback.print_exc()
+
+        if not self.isInterruptionRequested():
+            self.fetch_result.emit(unpush_key, unpush_list, ahead, behind)
+
+    def get_upstream(self, head):
+        branch = self.repo.branches.local.get(head.shorthand)
+
+        try:
+            if branch is not None and branch.upstream is not None:
+                return branch.upstream
+        except (KeyError, ValueError, GitError):
+            pass
+
+        # No upstream is configured, fallback to branch with same name of default remote.
+        return self.repo.branches.remote.get("{}/{}".format(get_push_remote_name(self.repo, head.shorthand), head.shorthand))
 
 class HighlightDiffThread(QThread):
 
     fetch_result = QtCore.pyqtSignal(str, str, float, str, list)
+    append_result = QtCore.pyqtSignal(str, str, float, list)
+    finish_result = QtCore.pyqtSignal(str, str, float, object, int)
 
-    def __init__(self, target, type, file, tick):
+    # Lines of hunks send in first batch, so top of huge diff show immediately.
+    FIRST_BATCH_LINES = 500
+
+    # Lines of hunks highlighted and send at once after first batch.
+    BATCH_LINES = 5000
+
+    def __init__(self, target, type, file, tick, pending=None):
         QThread.__init__(self)
 
         self.target = target
@@ -2528,62 +4196,211 @@ class HighlightDiffThread(QThread):
         self.file = file
         self.tick = tick
 
-    def parse_diff_and_color(self, patch_set):
-        return parse_patch(patch_set, self.target.highlight_diff_strict)
+        # Hunks and fragments that truncated by last thread, show more diff continue from them.
+        self.pending = pending
+
+    def stream_hunks(self, hunks, fragments=None, first_batch=True):
+        """
+        Highlight hunks and send them to page batch by batch, fragments are given if hunks already highlighted.
+        Stop after truncate lines, rest of hunks is send by finish_result for show more diff.
+        Return fragments of all hunks, or None if diff is truncated or not current diff anymore.
+        """
+        truncate_lines = self.target.diff_truncate_lines
+        all_fragments = []
+        sent_lines = 0
+        start = 0
+
+        while start < len(hunks):
+            # Stop if other diff is selected.
+            if self.target.diff_tick != self.tick:
+                return None
+
+            hidden_lines = sum(hunk[4] for hunk in hunks[start:]) if truncate_lines > 0 and sent_lines >= truncate_lines else 0
+            if hidden_lines > 0:
+                self.finish_result.emit(self.type, self.file, self.tick, (hunks[start:], fragments[start:] if fragments is not None else None), hidden_lines)
+                return None
+
+            end = start
+            batch_lines = 0
+            while end < len(hunks) and batch_lines < (self.FIRST_BATCH_LINES if first_batch else self.BATCH_LINES):
+                batch_lines += hunks[end][4]
+                end += 1
+
+            if fragments is None:
+                texts = [hunk[3] for hunk in hunks[start:end] if hunk[3] is not None]
+                batch_fragments = iter(self.target.highlight_service.highlight(texts, self.target.highlight_style))
+                batch_fragments = [next(batch_fragments) if hunk[3] is not None else None for hunk in hunks[start:end]]
+            else:
+                batch_fragments = fragments[start:end]
+
+            # Hunks of same patch may be split to several batches, page append them by patch index.
+            patches = []
+            for ((patch_index, path, patch_info, _, _), fragment) in zip(hunks[start:end], batch_fragments):
+                if len(patches) == 0 or patches[-1]["index"] != patch_index:
+                    patches.append({"index": patch_index, "path": path, "patch_info": patch_info, "diff_hunks": []})
+                if fragment is not None:
+                    patches[-1]["diff_hunks"].append(fragment)
+
+            if first_batch:
+                self.fetch_result.emit(self.type, self.file, self.tick, "", patches)
+                first_batch = False
+            else:
+                self.append_result.emit(self.type, self.file, self.tick, patches)
+
+            all_fragments += batch_fragments
+            sent_lines += batch_lines
+            start = end
+
+        self.finish_result.emit(self.type, self.file, self.tick, None, 0)
+        return all_fragments
+
+    def get_file_stat(self, file):
+        try:
+            stat = os.stat(os.path.join(self.target.repo_root, file))
+            return (stat.st_size, stat.st_mtime_ns, stat.st_mode)
+        except OSError:
+            return None
+
+    def get_blob_data_id(self, blob_or_data):
+        if blob_or_data is None:
+            return None
+        elif isinstance(blob_or_data, bytes):
+            return str(pygit2.hash(blob_or_data))
+        else:
+            return str(blob_or_data.id)
+
+    def get_file_diff_string(self, blobs):
+        patch_data = get_file_patch_data(self.target.repo, self.type, self.file, blobs)
+        return "\n".join(map(lambda data : NO_PREVIEW if is_binary(data) else bytes_decode(data), patch_data))
+
+    def get_file_blobs(self):
+        "Return blobs of staged or unstaged file that diff key and diff both use, None if file is diffed from repository diff."
+        repo = self.target.repo
+
+        if self.file == "" or self.type not in ["stage", "unstage"] or repo.head_is_unborn:
+            return None
+
+        try:
+            return get_file_patch_blobs(repo, self.type, self.file)
+        except (OSError, KeyError, GitError):
+            return None
+
+    def get_diff_key(self, blobs):
+        """
+        Return key of diff content, or None if diff is not cacheable.
+        Key of file diff is ids of blobs that are diffed, other keys use file stat and need check again after diff.
+        """
+        repo = self.target.repo
+        style = self.target.highlight_style
+
+        if self.type == "untrack" or repo.head_is_unborn:
+            # Whole untracked diff depend on files that status may not know yet.
+            if self.file != "":
+                return ("untrack", self.file, self.get_file_stat(self.file), style)
+        elif blobs is not None:
+            (old_blob, new_blob) = blobs
+            return (self.type, self.file, self.get_blob_data_id(old_blob), self.get_blob_data_id(new_blob), style)
+        elif self.type == "stage" and self.file == "":
+            head_tree = repo.revparse_single("HEAD^{tree}")
+            index_stat = os.stat(os.path.join(repo.path, "index"))
+            return ("stage", "", str(head_tree.id), index_stat.st_size, index_stat.st_mtime_ns, style)
+
+        return None
+
+    def is_diff_key_unchanged(self, diff_key, blobs):
+        # Blobs are exactly what was diffed.
+        if blobs is not None:
+            return True
+
+        try:
+            return self.get_diff_key(blobs) == diff_key
+        except (OSError, KeyError, GitError):
+            return False
 
     def run(self):
+        if self.pending is not None:
+            (hunks, fragments) = self.pending
+            self.stream_hunks(hunks, fragments, first_batch=False)
+            return
+
+        blobs = self.get_file_blobs()
+        try:
+            diff_key = self.get_diff_key(blobs)
+        except (OSError, KeyError, GitError):
+            diff_key = None
+
+        cache_entry = self.target.diff_cache.get(diff_key) if diff_key is not None else None
+        if cache_entry is not None:
+            (diff_string, hunks, fragments, raw_patch_set, _) = cache_entry
+            if raw_patch_set is not None:
+                self.target.raw_patch_set = raw_patch_set
+
+            if len(hunks) == 0:
+                self.fetch_result.emit(self.type, self.file, self.tick, diff_string, [])
+                self.finish_result.emit(self.type, self.file, self.tick, None, 0)
+            else:
+                self.stream_hunks(hunks, fragments)
+            return
+
         diff_string = ""
-        patch_set = []
+        raw_patch_set = None
 
         if self.type == "untrack" or self.target.repo.head_is_unborn:
             if self.file == "":
                 show_whole_diff = get_emacs_var("eaf-git-show-whole-untracked-diff")
                 if show_whole_diff:
                     for status in self.target.untrack_status:
-                        path = os.path.join(self.target.repo_root, status["file"])
+                        path = os.path.join(self.target.repo_root, status.file)
                         if os.path.isfile(path):
-                            diff_string += "Untrack file: {}\n\n".format(status["file"])
-                            diff_string += str(NO_PREVIEW if is_binary(path) else from_path(path).best())
+                            diff_string += "Untrack file: {}\n\n".format(status.file)
+                            diff_string += str(NO_PREVIEW if self.target.file_metadata_cache.is_binary(path) else from_path(path).best())
                             diff_string += "\n"
                         else:
                             # submodule directory
-                            diff_string += "Untrack: {}\n\n".format(status["file"])
+                            diff_string += "Untrack: {}\n\n".format(status.file)
                             diff_string += "\n"
 
             else:
                 path = os.path.join(self.target.repo_root, self.file)
                 if os.path.isfile(path):
-                    diff_string = str(NO_PREVIEW if is_binary(path) else from_path(path).best())
+                    diff_string = str(NO_PREVIEW if self.target.file_metadata_cache.is_binary(path) else from_path(path).best())
                 else:
                     diff_string = ""
 
         elif self.type == "stage":
-            head_tree = self.target.repo.revparse_single("HEAD^{tree}")
-            stage_diff = self.target.repo.index.diff_to_tree(head_tree)
             if self.file == "":
-                diff_string = stage_diff.patch
-                self.target.raw_patch_set = PatchSet(diff_string)
-                patch_set = self.parse_diff_and_color(self.target.raw_patch_set)
+                head_tree = self.target.repo.revparse_single("HEAD^{tree}")
+                diff_string = self.target.repo.index.diff_to_tree(head_tree).patch
             else:
-                patches = [patch for patch in stage_diff if patch.delta.new_file.path == self.file]
-                diff_string = "\n".join(map(lambda patch : NO_PREVIEW if is_binary(patch.data) else bytes_decode(patch.data), patches))
-                self.target.raw_patch_set = PatchSet(diff_string)
-                patch_set = self.parse_diff_and_color(self.target.raw_patch_set)
+                diff_string = self.get_file_diff_string(blobs)
+            raw_patch_set = PatchSet(diff_string)
 
         elif self.type == "unstage":
-            unstage_diff = self.target.repo.diff(cached=True)
             if self.file == "":
-                diff_string = unstage_diff.patch
-                self.target.raw_patch_set = PatchSet(diff_string)
-                patch_set = self.parse_diff_and_color(self.target.raw_patch_set)
+                diff_string = self.target.repo.diff(cached=True).patch
             else:
-                patches = [patch for patch in unstage_diff if patch.delta.new_file.path == self.file]
-                diff_string = "\n".join(map(lambda patch : NO_PREVIEW if is_binary(patch.data) else bytes_decode(patch.data), patches))
-                self.target.raw_patch_set = PatchSet(diff_string)
-                patch_set = self.parse_diff_and_color(self.target.raw_patch_set)
+                diff_string = self.get_file_diff_string(blobs)
+            raw_patch_set = PatchSet(diff_string)
+
+        hunks = []
+        if raw_patch_set is not None:
+            self.target.raw_patch_set = raw_patch_set
+            hunks = get_patch_hunks(raw_patch_set)
+
+        if len(hunks) == 0:
+            # Page only show whole diff if there is no hunk.
+            diff_string = self.target.highlight_service.highlight([diff_string], self.target.highlight_style, strict=False)[0]
+            self.fetch_result.emit(self.type, self.file, self.tick, diff_string, [])
+            self.finish_result.emit(self.type, self.file, self.tick, None, 0)
+            fragments = []
+        else:
+            diff_string = ""
+            fragments = self.stream_hunks(hunks)
 
-        diff_string = self.target.highlight_diff(diff_string)
-        self.fetch_result.emit(self.type, self.file, self.tick, diff_string, patch_set)
+        # Don't cache truncated diff, it only has fragments of first hunks.
+        # Key from file stat is dropped if file changed while diffing.
+        if diff_key is not None and fragments is not None and self.is_diff_key_unchanged(diff_key, blobs):
+            self.target.diff_cache.put(diff_key, diff_string, hunks, fragments, raw_patch_set)
 
 class FetchPrListThread(QThread):
     fetch_result = QtCore.pyqtSignal(list)
@@ -133,6 +133,7 @@
       ("k"  ("js_status_select_prev" "Prev"))
       ("n"  ("js_hunks_select_next" "Next Hunk"))
       ("p"  ("js_hunks_select_prev" "Prev Hunk"))
+      ("M"  ("py_status_show_more_diff" "Show more diff"))
       (","  ("js_status_preview_scroll_up_line" "Code up line"))
       ("."  ("js_status_preview_scroll_down_line" "Code down line"))
       ("<"  ("js_status_preview_scroll_up" "Code up"))
@@ -294,6 +295,56 @@ will be added if not present."
   "Show the whole diff for all untracked files"
   :type 'boolean)
 
+(defcustom eaf-git-diff-truncate-lines 20000
+  "Only show first lines of huge diff in preview, rest of diff is shown by command `Show more diff'.
+
+Diff is sent to preview in batches, so first hunks show before whole diff is highlighted.
+Show whole diff if 0."
+  :type 'integer)
+
+(defcustom eaf-git-collapse-untracked-directory nil
+  "Show untracked directory as one collapsed item with file count.
+
+Files in untracked directory are listed only when toggle state of directory item."
+  :type 'boolean)
+
+(defcustom eaf-git-persist-file-metadata-cache nil
+  "Save mime, binary flag and line count cache of worktree files under git directory.
+
+Unchanged files won't be sniffed again when open the same repository next time."
+  :type 'boolean)
+
+(defcustom eaf-git-persist-commit-log-cache nil
+  "Save id, time, author and subject of log commits under git directory.
+
+Refresh log only walk commits newer than cached branch tip, the rest are loaded from cache.
+Cache is always kept in memory of buffer, this option let it reused when open repository again."
+  :type 'boolean)
+
+(defcustom eaf-git-watch-worktree t
+  "Watch worktree changes by inotify, only re-query changed files when refresh status.
+
+Need python library `watchdog', fallback to full status refresh if it is not installed."
+  :type 'boolean)
+
+(defcustom eaf-git-status-ignore-submodules nil
+  "Don't check changes inside submodules when refresh status.
+
+Speed up status of repository with many submodules, status is fetched by git command if enabled."
+  :type 'boolean)
+
+(defcustom eaf-git-status-untracked-cache nil
+  "Use untracked cache of index when refresh status.
+
+Git only rescan directories that changed since last status, status is fetched by git command if enabled."
+  :type 'boolean)
+
+(defcustom eaf-git-status-pathspecs nil
+  "Only show status of files match these pathspecs, such as subtree of your team.
+
+Show status of whole repository if nil, status is fetched by git command if set."
+  :type '(repeat string))
+
 (defcustom eaf-git-commit-and-push-hook '()
   "The hook running when call command `status_commit_and_push'."
   :type 'hook)
@@ -19,21 +19,22 @@ export function getListPageElementNumber(list) {
 }
 
 export function updateListItemBackground(list, oldIndex, newIndex, backgroundColor, selectColor) {
-    if (oldIndex !== null && oldIndex >= 0) {
+    // Index may be not loaded yet for paged list.
+    if (oldIndex !== null && oldIndex >= 0 && oldIndex < list.length) {
         list[oldIndex].backgroundColor = backgroundColor;
     }
 
-    if (newIndex !== null && newIndex >= 0) {
+    if (newIndex !== null && newIndex >= 0 && newIndex < list.length) {
         list[newIndex].backgroundColor = selectColor;
     }
 }
 
 export function updateListItemMatchColor(list, oldIndex, newIndex, matchColor) {
-    if (oldIndex !== null && oldIndex >= 0) {
+    if (oldIndex !== null && oldIndex >= 0 && oldIndex < list.length) {
         list[oldIndex].foregroundColor = "";
     }
 
-    if (newIndex !== null && newIndex >= 0) {
+    if (newIndex !== null && newIndex >= 0 && newIndex < list.length) {
         list[newIndex].foregroundColor = matchColor;
     }
 }
@@ -48,6 +49,116 @@ export function updateListIndex(list, index) {
     }
 }
 
+/**
+ * Decode columnar log batch from Python to log items, new authors of batch are appended to author table.
+ */
+export function decodeLogBatch(logBatch, authors) {
+    authors.splice(logBatch.authorOffset, authors.length - logBatch.authorOffset, ...logBatch.authors);
+
+    const logInfo = logBatch.id.map((id, index) => ({
+        id: id,
+        index: logBatch.offset + index,
+        timestamp: logBatch.time[index],
+        timeOffset: logBatch.timeOffset[index],
+        time: "",
+        author: authors[logBatch.author[index]],
+        message: logBatch.message[index],
+        marked: "",
+        foregroundColor: "",
+        backgroundColor: ""
+    }));
+    updateRelativeTimes(logInfo, "time");
+
+    return logInfo;
+}
+
+/**
+ * Format epoch seconds to relative time, such as "3 hours ago".
+ */
+export function prettyDate(timestamp, now) {
+    if (timestamp === null || timestamp === undefined || timestamp > now) {
+        return "";
+    }
+
+    const diff = Math.floor(now - timestamp);
+    const dayDiff = Math.floor(diff / 86400);
+    const secondDiff = diff % 86400;
+
+    if (dayDiff === 0) {
+        if (secondDiff < 10) {
+            return "just now";
+        } else if (secondDiff < 60) {
+            return secondDiff + " seconds ago";
+        } else if (secondDiff < 120) {
+            return "a minute ago";
+        } else if (secondDiff < 3600) {
+            return Math.floor(secondDiff / 60) + " minutes ago";
+        } else if (secondDiff < 7200) {
+            return "an hour ago";
+        } else {
+            return Math.floor(secondDiff / 3600) + " hours ago";
+        }
+    } else if (dayDiff === 1) {
+        return "Yesterday";
+    } else if (dayDiff < 7) {
+        return dayDiff + " days ago";
+    } else if (dayDiff < 31) {
+        return Math.floor(dayDiff / 7) + " weeks ago";
+    } else if (dayDiff < 365) {
+        return Math.floor(dayDiff / 30) + " months ago";
+    } else {
+        return Math.floor(dayDiff / 365) + " years ago";
+    }
+}
+
+/**
+ * Format epoch seconds in timezone of commit, timeOffset is minutes east of UTC, such as "2022-06-01 10:30 +0800".
+ */
+export function formatLocalDate(timestamp, timeOffset) {
+    if (timestamp === null || timestamp === undefined) {
+        return "";
+    }
+
+    const date = new Date((timestamp + timeOffset * 60) * 1000);
+    const absOffset = Math.abs(timeOffset);
+    const pad = (number) => String(number).padStart(2, "0");
+
+    return date.getUTCFullYear() + "-" + pad(date.getUTCMonth() + 1) + "-" + pad(date.getUTCDate()) + " " +
+        pad(date.getUTCHours()) + ":" + pad(date.getUTCMinutes()) + " " +
+        (timeOffset < 0 ? "-" : "+") + pad(Math.floor(absOffset / 60)) + pad(absOffset % 60);
+}
+
+/**
+ * Format "timestamp" of items to relative time field in one pass, same text won't trigger render again.
+ */
+export function updateRelativeTimes(list, key) {
+    const now = Date.now() / 1000;
+
+    for (const item of list) {
+        item[key] = prettyDate(item.timestamp, now);
+    }
+}
+
+export function applyStatusDelta(list, delta) {
+    if (delta.reset !== undefined) {
+        return delta.reset;
+    }
+
+    const removed = new Set(delta.removed);
+    const result = list.filter(info => !removed.has(info.file));
+
+    // Upsert items come with ascending index, so every index is valid at the time of insertion.
+    delta.upsert.forEach(([index, info]) => {
+        if (index < result.length && result[index].file === info.file) {
+            result.splice(index, 1, info);
+        } else {
+            result.splice(index, 0, info);
+        }
+    });
+
+    return result;
+}
+
 export function regsiterJsFunctions(object, eventNames) {
     const that = object;
 
@@ -74,6 +185,11 @@ function toCamelCase(str) {
     return camelCasedWords.join('');
 }
 
+/**
+ * Number of commits in one page of log, same as LOG_PAGE_SIZE in buffer.py
+ */
+export const LOG_PAGE_SIZE = 200;
+
 /**
  * Layout, same as the Elisp custom variable "eaf-git-layout"
  */
@@ -19,6 +19,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from functools import lru_cache
+
 def get_git_https_url(url: str):
     from giturlparse import parse
     
@@ -34,3 +36,69 @@ def get_git_https_url(url: str):
         
 
 
+# Blob result of grep log worker process, reused by later chunks and searches of same keyword.
+grep_log_blob_memo = {}
+
+# Drop memo if it's too big, blob ids of whole history may use much memory.
+GREP_LOG_BLOB_MEMO_MAX_SIZE = 1000000
+
+def grep_log_commits(repo_path, keyword, commit_ids, blob_memo=None):
+    """
+    Return ids of commits whose diff to first parent contain keyword in file path or hunk line, keep order of commit_ids.
+    Tree diff only visit files changed by commit, and patch of file is only generated
+    if old or new blob contain keyword, blob result is memoized for later commits.
+    Blob memo of worker process is used if blob_memo is None, so this module should not import Qt.
+    """
+    from pygit2 import Blob, Repository
+
+    repo = Repository(repo_path)
+    content_keyword = keyword.encode("utf-8")
+
+    if blob_memo is None:
+        # Blob id is hash of content, so memo is valid for any repository.
+        if grep_log_blob_memo.get("keyword") != keyword or len(grep_log_blob_memo.get("blobs", {})) > GREP_LOG_BLOB_MEMO_MAX_SIZE:
+            grep_log_blob_memo.clear()
+            grep_log_blob_memo["keyword"] = keyword
+        blob_memo = grep_log_blob_memo.setdefault("blobs", {})
+
+    def blob_contain_keyword(blob_id):
+        contain = blob_memo.get(blob_id)
+        if contain is None:
+            blob = repo.get(blob_id)
+            contain = blob_memo[blob_id] = isinstance(blob, Blob) and content_keyword in blob.data
+        return contain
+
+    match_ids = []
+    for commit_id in commit_ids:
+        commit = repo[commit_id]
+        diff = repo.diff(commit.parents[0], commit)
+
+        for (delta_index, delta) in enumerate(diff.deltas):
+            if keyword in delta.old_file.path or keyword in delta.new_file.path:
+                match_ids.append(commit_id)
+                break
+
+            if blob_contain_keyword(delta.old_file.id) or blob_contain_keyword(delta.new_file.id):
+                if any(keyword in line.content for hunk in diff[delta_index].hunks for line in hunk.lines):
+                    match_ids.append(commit_id)
+                    break
+
+    return match_ids
+
+@lru_cache(maxsize=8)
+def get_highlight_formatter(style):
+    "Formatter of HTML fragment, style sheet of highlight style is sent to page separately."
+    from pygments.formatters import HtmlFormatter
+
+    return HtmlFormatter(style=style)
+
+def highlight_diff_fragments(contents, style, strict=True):
+    """
+    Highlight contents to HTML fragments, use diff lexer if strict, otherwise guess lexer from content.
+    Run in highlight worker process, so this module should not import Qt.
+    """
+    from pygments import highlight
+    from pygments.lexers import DiffLexer, guess_lexer
+
+    formatter = get_highlight_formatter(style)
+    return [highlight(content, DiffLexer() if strict else guess_lexer(content), formatter) for content in contents]